@@ -1,10 +1,17 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import json
 import os
+import asyncio
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
+from shared import metrics
 
 app = FastAPI(title='Feedback Storage Service')
 
@@ -15,8 +22,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+metrics.instrument(app, 'feedback-storage')
 
-# Simple file-based storage (in production, use a database)
+# SQLite (WAL mode) storage; the legacy JSON file is imported once on first start
+DB_FILE = os.getenv('FEEDBACK_DB', 'feedback_data.db')
 STORAGE_FILE = "feedback_data.json"
 
 class FeedbackSubmission(BaseModel):
@@ -45,80 +54,447 @@ class StoredFeedback(BaseModel):
     assigned_to: Optional[str] = None
     notes: Optional[str] = None
 
-def load_feedback_data():
-    """Load feedback data from file"""
-    if os.path.exists(STORAGE_FILE):
+ANALYSIS_PARTS = ('sentiment', 'urgency', 'themes', 'evidence', 'suggestion')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    employee_email TEXT NOT NULL,
+    employee_name TEXT NOT NULL,
+    rating INTEGER,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    assigned_to TEXT,
+    notes TEXT,
+    sentiment TEXT,
+    urgency TEXT,
+    theme TEXT,
+    analysis_sentiment TEXT,
+    analysis_urgency TEXT,
+    analysis_themes TEXT,
+    analysis_evidence TEXT,
+    analysis_suggestion TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_status ON feedback(status);
+CREATE INDEX IF NOT EXISTS idx_feedback_urgency ON feedback(urgency);
+CREATE INDEX IF NOT EXISTS idx_feedback_sentiment ON feedback(sentiment);
+CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback(timestamp);
+CREATE TABLE IF NOT EXISTS feedback_counters (
+    dimension TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, bucket, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS feedback_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    feedback_id INTEGER NOT NULL,
+    ts TEXT NOT NULL,
+    payload TEXT
+);
+"""
+
+# Append-only change log: one row per submit / status update / delete, written
+# in the same transaction as the change itself. Only the newest
+# CHANGES_RETENTION entries are kept; older cursors get a reset signal.
+CHANGES_RETENTION = int(os.getenv('CHANGES_RETENTION', '10000'))
+CHANGES_PAGE_SIZE = 500
+# Stream subscribers are woken by writes in this process and also re-check
+# the log this often, so writes from other worker processes are picked up
+CHANGES_POLL_SECONDS = float(os.getenv('CHANGES_POLL_SECONDS', '2'))
+CHANGES_KEEPALIVE_SECONDS = 15
+
+# Database time per operation (save = submit, load_* = reads), lock wait included
+STORAGE_SECONDS = metrics.histogram(
+    'storage_operation_seconds', 'feedback_storage database time per operation', ('operation',)
+)
+
+_db = None
+_db_pid = None
+_db_lock = threading.RLock()
+
+def get_db() -> sqlite3.Connection:
+    """Per-process connection (reopened after fork), schema created on first use"""
+    global _db, _db_pid
+    if _db is None or _db_pid != os.getpid():
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        columns = {r['name'] for r in conn.execute('PRAGMA table_info(feedback)')}
+        if 'theme' not in columns:
+            conn.execute('ALTER TABLE feedback ADD COLUMN theme TEXT')
+        _db, _db_pid = conn, os.getpid()
+        migrate_json_file(conn)
+        if not conn.execute('SELECT 1 FROM feedback_counters LIMIT 1').fetchone():
+            rebuild_counters(conn)
+        if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            backfill_sentiment(conn)
+    return _db
+
+@contextmanager
+def transaction():
+    """Serialized write transaction; BEGIN IMMEDIATE takes the write lock up front"""
+    with _db_lock:
+        conn = get_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+SENTIMENT_LABELS = ('Positive', 'Negative', 'Neutral')
+
+def sentiment_label(sentiment) -> Optional[str]:
+    """Positive / Negative / Neutral from an analysis.sentiment dict ({label} or the agent's {sentiment}) or a label"""
+    if isinstance(sentiment, dict):
+        sentiment = sentiment.get('label') or sentiment.get('sentiment')
+    if not isinstance(sentiment, str) or not sentiment:
+        return None
+    label = sentiment.capitalize()
+    return label if label in SENTIMENT_LABELS else sentiment
+
+def _row_values(record: dict) -> dict:
+    analysis = record.get('analysis') or {}
+    values = {
+        'text': record.get('text', ''),
+        'employee_email': record.get('employee_email', ''),
+        'employee_name': record.get('employee_name', ''),
+        'rating': record.get('rating'),
+        'timestamp': record.get('timestamp') or datetime.now().isoformat(),
+        'status': record.get('status') or 'pending',
+        'assigned_to': record.get('assigned_to'),
+        'notes': record.get('notes'),
+        'sentiment': sentiment_label(analysis.get('sentiment')),
+        'urgency': (analysis.get('urgency') or {}).get('urgency'),
+        'theme': ((analysis.get('themes') or {}).get('classification') or {}).get('label') or None,
+    }
+    for part in ANALYSIS_PARTS:
+        values[f'analysis_{part}'] = json.dumps(analysis.get(part) or {}, ensure_ascii=False)
+    return values
+
+def _buckets(timestamp: Optional[str]) -> list[str]:
+    """Counter buckets a record falls into: all-time, its day and its ISO week"""
+    try:
+        ts = datetime.fromisoformat(timestamp)
+    except Exception:
+        ts = datetime.now()
+    year, week, _ = ts.isocalendar()
+    return ['all', f'day:{ts.date().isoformat()}', f'week:{year}-W{week:02d}']
+
+def _counter_values(row) -> list[tuple[str, str]]:
+    # Missing labels count under the same defaults /stats always used
+    pairs = [
+        ('total', 'all'),
+        ('sentiment', row['sentiment'] or 'Neutral'),
+        ('urgency', row['urgency'] or 'Low'),
+        ('status', row['status'] or 'pending'),
+    ]
+    if row['theme']:
+        pairs.append(('theme', row['theme']))
+    return pairs
+
+def _bump(conn: sqlite3.Connection, pairs: list[tuple[str, str]], timestamp: Optional[str], delta: int):
+    """Adjust materialized counters; must run inside the write transaction that changed the row"""
+    conn.executemany(
+        'INSERT INTO feedback_counters (dimension, bucket, value, count) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (dimension, bucket, value) DO UPDATE SET count = count + excluded.count',
+        [(dim, bucket, value, delta) for dim, value in pairs for bucket in _buckets(timestamp)]
+    )
+
+def rebuild_counters(conn: sqlite3.Connection):
+    """Recompute all counters from the feedback table (used once for pre-counter databases)"""
+    with _db_lock:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM feedback_counters')
+            for row in conn.execute('SELECT sentiment, urgency, status, theme, timestamp FROM feedback'):
+                _bump(conn, _counter_values(row), row['timestamp'], 1)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+def backfill_sentiment(conn: sqlite3.Connection):
+    """Recompute the sentiment column (and counters) for rows written before sentiment_label"""
+    with _db_lock:
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            rows = conn.execute('SELECT id, sentiment, analysis_sentiment FROM feedback').fetchall()
+            updates = []
+            for row in rows:
+                label = sentiment_label(json.loads(row['analysis_sentiment'] or '{}'))
+                if label != row['sentiment']:
+                    updates.append((label, row['id']))
+            conn.executemany('UPDATE feedback SET sentiment = ? WHERE id = ?', updates)
+            conn.execute('PRAGMA user_version = 1')
+            conn.execute('COMMIT')
         except Exception:
-            return []
-    return []
+            conn.execute('ROLLBACK')
+            raise
+    if updates:
+        rebuild_counters(conn)
+
+def _insert(conn: sqlite3.Connection, record: dict) -> int:
+    values = _row_values(record)
+    if record.get('id') is not None:
+        values['id'] = record['id']
+    cols = ', '.join(values)
+    marks = ', '.join(f':{c}' for c in values)
+    new_id = conn.execute(f'INSERT INTO feedback ({cols}) VALUES ({marks})', values).lastrowid
+    _bump(conn, _counter_values(values), values['timestamp'], 1)
+    return new_id
+
+_changes_signal = asyncio.Event()
+
+def _log_change(conn: sqlite3.Connection, op: str, feedback_id: int, payload: Optional[dict]):
+    """Record a change; must run inside the write transaction that made it"""
+    seq = conn.execute(
+        'INSERT INTO feedback_changes (op, feedback_id, ts, payload) VALUES (?, ?, ?, ?)',
+        (op, feedback_id, datetime.now().isoformat(),
+         json.dumps(payload, ensure_ascii=False) if payload is not None else None)
+    ).lastrowid
+    # Trim periodically rather than on every write
+    if seq % 100 == 0:
+        conn.execute('DELETE FROM feedback_changes WHERE seq <= ?', (seq - CHANGES_RETENTION,))
+    return seq
+
+def _notify_changes():
+    """Wake stream subscribers after a commit"""
+    global _changes_signal
+    _changes_signal.set()
+    _changes_signal = asyncio.Event()
 
-def save_feedback_data(data):
-    """Save feedback data to file"""
+def _read_changes(since: int, limit: int = CHANGES_PAGE_SIZE) -> dict:
+    conn = get_db()
+    with STORAGE_SECONDS.time(operation='load_changes'):
+        oldest = conn.execute('SELECT MIN(seq) FROM feedback_changes').fetchone()[0]
+        rows = conn.execute(
+            'SELECT seq, op, feedback_id, ts, payload FROM feedback_changes WHERE seq > ? ORDER BY seq LIMIT ?',
+            (since, limit)
+        ).fetchall()
+    changes = [
+        {'seq': r['seq'], 'op': r['op'], 'id': r['feedback_id'], 'ts': r['ts'],
+         'data': json.loads(r['payload']) if r['payload'] else None}
+        for r in rows
+    ]
+    return {
+        'changes': changes,
+        'last_seq': changes[-1]['seq'] if changes else max(since, _current_seq(conn)),
+        # The log was trimmed past the client's cursor: it must reload /feedback
+        'reset': oldest is not None and since < oldest - 1,
+        'more': len(rows) == limit,
+    }
+
+def _current_seq(conn: sqlite3.Connection) -> int:
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM feedback_changes').fetchone()[0]
+
+def row_to_feedback(row: sqlite3.Row) -> dict:
+    """Rebuild the StoredFeedback-shaped dict the API has always returned"""
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'employee_email': row['employee_email'],
+        'employee_name': row['employee_name'],
+        'rating': row['rating'],
+        'timestamp': row['timestamp'],
+        'analysis': {part: json.loads(row[f'analysis_{part}'] or '{}') for part in ANALYSIS_PARTS},
+        'status': row['status'],
+        'assigned_to': row['assigned_to'],
+        'notes': row['notes'],
+    }
+
+def migrate_json_file(conn: sqlite3.Connection):
+    """One-shot import of the legacy feedback_data.json into an empty database"""
+    if not os.path.exists(STORAGE_FILE):
+        return
+    if conn.execute('SELECT 1 FROM feedback LIMIT 1').fetchone():
+        return
     try:
-        with open(STORAGE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        return True
+        with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     except Exception as e:
-        print(f"Error saving feedback data: {e}")
-        return False
+        print(f"Skipping migration of {STORAGE_FILE}: {e}")
+        return
+    with _db_lock:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for record in data:
+                _insert(conn, record)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    os.replace(STORAGE_FILE, STORAGE_FILE + '.migrated')
+    print(f"Migrated {len(data)} feedback records from {STORAGE_FILE} to {DB_FILE}")
 
 @app.post('/submit')
 async def submit_feedback(feedback: FeedbackSubmission, analysis: FeedbackAnalysis):
     """Store feedback with analysis results"""
     try:
-        # Load existing data
-        data = load_feedback_data()
-        
-        # Generate new ID
-        new_id = max([f.get('id', 0) for f in data], default=0) + 1
-        
-        # Create stored feedback object
-        stored_feedback = StoredFeedback(
-            id=new_id,
-            text=feedback.text,
-            employee_email=feedback.employee_email,
-            employee_name=feedback.employee_name,
-            rating=feedback.rating,
-            timestamp=feedback.timestamp or datetime.now().isoformat(),
-            analysis=analysis,
-            status="pending"
-        )
-        
-        # Add to data
-        data.append(stored_feedback.dict())
-        
-        # Save to file
-        if save_feedback_data(data):
-            return {"success": True, "id": new_id, "message": "Feedback stored successfully"}
-        else:
-            raise HTTPException(500, "Failed to save feedback")
-            
+        record = {
+            'text': feedback.text,
+            'employee_email': feedback.employee_email,
+            'employee_name': feedback.employee_name,
+            'rating': feedback.rating,
+            'timestamp': feedback.timestamp or datetime.now().isoformat(),
+            'analysis': analysis.dict(),
+            'status': "pending"
+        }
+
+        # ID is allocated by SQLite inside the insert, so concurrent submits never collide
+        with STORAGE_SECONDS.time(operation='save'), transaction() as conn:
+            new_id = _insert(conn, record)
+            row = conn.execute('SELECT * FROM feedback WHERE id = ?', (new_id,)).fetchone()
+            _log_change(conn, 'submit', new_id, row_to_feedback(row))
+        _notify_changes()
+
+        return {"success": True, "id": new_id, "message": "Feedback stored successfully"}
+
     except Exception as e:
         raise HTTPException(500, f"Error storing feedback: {str(e)}")
 
+FEEDBACK_FIELDS = (
+    'id', 'text', 'employee_email', 'employee_name', 'rating', 'timestamp',
+    'status', 'assigned_to', 'notes', 'analysis'
+)
+SORT_COLUMNS = ('id', 'timestamp')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _parse_fields(fields: Optional[str]) -> tuple[list[str], list[str]]:
+    """Split a fields= projection into top-level fields and analysis parts"""
+    if not fields:
+        return list(FEEDBACK_FIELDS), list(ANALYSIS_PARTS)
+    top, parts = [], []
+    for name in (f.strip() for f in fields.split(',')):
+        if not name:
+            continue
+        if name == 'analysis':
+            top.append(name)
+            parts.extend(p for p in ANALYSIS_PARTS if p not in parts)
+        elif name.startswith('analysis.') and name[9:] in ANALYSIS_PARTS:
+            if 'analysis' not in top:
+                top.append('analysis')
+            if name[9:] not in parts:
+                parts.append(name[9:])
+        elif name in FEEDBACK_FIELDS:
+            if name not in top:
+                top.append(name)
+        else:
+            raise HTTPException(400, f"Unknown field: {name}")
+    return top, parts
+
+def _project(row: sqlite3.Row, top: list[str], parts: list[str]) -> dict:
+    out = {}
+    for name in top:
+        if name == 'analysis':
+            out['analysis'] = {part: json.loads(row[f'analysis_{part}'] or '{}') for part in parts}
+        else:
+            out[name] = row[name]
+    return out
+
+def _encode_cursor(value, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
 @app.get('/feedback')
-async def get_all_feedback():
-    """Get all stored feedback"""
+async def get_all_feedback(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    urgency: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    assigned_to: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    sort: str = 'id',
+    order: str = 'desc',
+    fields: Optional[str] = None
+):
+    """Get stored feedback, one page at a time.
+
+    Filters are exact matches (since/until compare ISO timestamps). Pass the
+    returned next_cursor to fetch the following page; fields= selects the
+    returned keys, e.g. fields=id,status,analysis.sentiment,analysis.urgency.
+    """
+    if sort not in SORT_COLUMNS:
+        raise HTTPException(400, f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    if order not in ('asc', 'desc'):
+        raise HTTPException(400, "order must be asc or desc")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    top, parts = _parse_fields(fields)
+
+    where, params = [], []
+    if sentiment is not None:
+        sentiment = sentiment_label(sentiment)
+    for column, value in (('status', status), ('urgency', urgency), ('sentiment', sentiment), ('assigned_to', assigned_to)):
+        if value is not None:
+            where.append(f'{column} = ?')
+            params.append(value)
+    if since:
+        where.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        where.append('timestamp < ?')
+        params.append(until)
+    if cursor:
+        value, row_id = _decode_cursor(cursor)
+        op = '>' if order == 'asc' else '<'
+        if sort == 'id':
+            where.append(f'id {op} ?')
+            params.append(row_id)
+        else:
+            where.append(f'(timestamp {op} ? OR (timestamp = ? AND id {op} ?))')
+            params.extend([value, value, row_id])
+
+    # Only the projected columns are read, so list views skip the large analysis blobs
+    columns = {'id', sort} | {f for f in top if f != 'analysis'} | {f'analysis_{p}' for p in parts}
+    sql = f'SELECT {", ".join(sorted(columns))} FROM feedback'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    direction = order.upper()
+    sql += f' ORDER BY {sort} {direction}' + (f', id {direction}' if sort != 'id' else '') + ' LIMIT ?'
+    params.append(limit + 1)
+
     try:
-        data = load_feedback_data()
-        return {"feedback": data, "count": len(data)}
+        # Read before the page so a client replaying /changes from here misses nothing
+        with STORAGE_SECONDS.time(operation='load_page'):
+            change_seq = _current_seq(get_db())
+            rows = get_db().execute(sql, params).fetchall()
     except Exception as e:
         raise HTTPException(500, f"Error loading feedback: {str(e)}")
 
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor(last[sort], last['id'])
+    data = [_project(r, top, parts) for r in rows]
+    return {"feedback": data, "count": len(data), "next_cursor": next_cursor, "change_seq": change_seq}
+
 @app.get('/feedback/{feedback_id}')
 async def get_feedback_by_id(feedback_id: int):
     """Get specific feedback by ID"""
     try:
-        data = load_feedback_data()
-        feedback = next((f for f in data if f.get('id') == feedback_id), None)
-        
-        if not feedback:
+        with STORAGE_SECONDS.time(operation='load_one'):
+            row = get_db().execute('SELECT * FROM feedback WHERE id = ?', (feedback_id,)).fetchone()
+
+        if not row:
             raise HTTPException(404, "Feedback not found")
-            
-        return feedback
+
+        return row_to_feedback(row)
     except HTTPException:
         raise
     except Exception as e:
@@ -128,25 +504,30 @@ async def get_feedback_by_id(feedback_id: int):
 async def update_feedback_status(feedback_id: int, status: str, assigned_to: Optional[str] = None, notes: Optional[str] = None):
     """Update feedback status and assignment"""
     try:
-        data = load_feedback_data()
-        feedback = next((f for f in data if f.get('id') == feedback_id), None)
-        
-        if not feedback:
-            raise HTTPException(404, "Feedback not found")
-        
-        # Update fields
-        feedback['status'] = status
-        if assigned_to:
-            feedback['assigned_to'] = assigned_to
-        if notes:
-            feedback['notes'] = notes
-        
-        # Save updated data
-        if save_feedback_data(data):
-            return {"success": True, "message": "Feedback updated successfully"}
-        else:
-            raise HTTPException(500, "Failed to update feedback")
-            
+        with STORAGE_SECONDS.time(operation='update'), transaction() as conn:
+            row = conn.execute('SELECT status, timestamp FROM feedback WHERE id = ?', (feedback_id,)).fetchone()
+            if not row:
+                raise HTTPException(404, "Feedback not found")
+
+            # Only overwrite assignment/notes when provided, as before
+            conn.execute(
+                'UPDATE feedback SET status = ?, '
+                'assigned_to = COALESCE(NULLIF(?, \'\'), assigned_to), '
+                'notes = COALESCE(NULLIF(?, \'\'), notes) '
+                'WHERE id = ?',
+                (status, assigned_to, notes, feedback_id)
+            )
+            if row['status'] != status:
+                _bump(conn, [('status', row['status'] or 'pending')], row['timestamp'], -1)
+                _bump(conn, [('status', status)], row['timestamp'], 1)
+            updated = conn.execute(
+                'SELECT status, assigned_to, notes FROM feedback WHERE id = ?', (feedback_id,)
+            ).fetchone()
+            _log_change(conn, 'status', feedback_id, dict(updated))
+        _notify_changes()
+
+        return {"success": True, "message": "Feedback updated successfully"}
+
     except HTTPException:
         raise
     except Exception as e:
@@ -156,69 +537,136 @@ async def update_feedback_status(feedback_id: int, status: str, assigned_to: Opt
 async def delete_feedback(feedback_id: int):
     """Delete feedback by ID"""
     try:
-        data = load_feedback_data()
-        original_count = len(data)
-        
-        # Remove feedback with matching ID
-        data = [f for f in data if f.get('id') != feedback_id]
-        
-        if len(data) == original_count:
-            raise HTTPException(404, "Feedback not found")
-        
-        # Save updated data
-        if save_feedback_data(data):
-            return {"success": True, "message": "Feedback deleted successfully"}
-        else:
-            raise HTTPException(500, "Failed to delete feedback")
-            
+        with STORAGE_SECONDS.time(operation='delete'), transaction() as conn:
+            row = conn.execute(
+                'SELECT sentiment, urgency, status, theme, timestamp FROM feedback WHERE id = ?', (feedback_id,)
+            ).fetchone()
+            if not row:
+                raise HTTPException(404, "Feedback not found")
+
+            conn.execute('DELETE FROM feedback WHERE id = ?', (feedback_id,))
+            _bump(conn, _counter_values(row), row['timestamp'], -1)
+            _log_change(conn, 'delete', feedback_id, None)
+        _notify_changes()
+
+        return {"success": True, "message": "Feedback deleted successfully"}
+
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(500, f"Error deleting feedback: {str(e)}")
 
+def _read_counters(conn: sqlite3.Connection, bucket: str) -> dict:
+    counts = {}
+    for row in conn.execute('SELECT dimension, value, count FROM feedback_counters WHERE bucket = ?', (bucket,)):
+        counts.setdefault(row['dimension'], {})[row['value']] = row['count']
+    return counts
+
 @app.get('/stats')
 async def get_feedback_stats():
-    """Get feedback statistics"""
+    """Get feedback statistics (read from counters maintained on every write)"""
     try:
-        data = load_feedback_data()
-        
-        if not data:
-            return {
-                "total": 0,
-                "by_sentiment": {"Positive": 0, "Negative": 0, "Neutral": 0},
-                "by_urgency": {"High": 0, "Medium": 0, "Low": 0},
-                "by_status": {"pending": 0, "resolved": 0, "in_progress": 0}
-            }
-        
-        # Calculate statistics
+        with STORAGE_SECONDS.time(operation='load_stats'):
+            counts = _read_counters(get_db(), 'all')
         stats = {
-            "total": len(data),
+            "total": counts.get('total', {}).get('all', 0),
             "by_sentiment": {"Positive": 0, "Negative": 0, "Neutral": 0},
             "by_urgency": {"High": 0, "Medium": 0, "Low": 0},
-            "by_status": {"pending": 0, "resolved": 0, "in_progress": 0}
+            "by_status": {"pending": 0, "resolved": 0, "in_progress": 0},
+            "by_theme": {k: v for k, v in counts.get('theme', {}).items() if v}
         }
-        
-        for feedback in data:
-            # Sentiment stats
-            sentiment = feedback.get('analysis', {}).get('sentiment', {}).get('label', 'Neutral')
-            if sentiment in stats["by_sentiment"]:
-                stats["by_sentiment"][sentiment] += 1
-            
-            # Urgency stats
-            urgency = feedback.get('analysis', {}).get('urgency', {}).get('urgency', 'Low')
-            if urgency in stats["by_urgency"]:
-                stats["by_urgency"][urgency] += 1
-            
-            # Status stats
-            status = feedback.get('status', 'pending')
-            if status in stats["by_status"]:
-                stats["by_status"][status] += 1
-        
+        for key, dim in (("by_sentiment", "sentiment"), ("by_urgency", "urgency"), ("by_status", "status")):
+            for value, count in counts.get(dim, {}).items():
+                if value in stats[key]:
+                    stats[key][value] = count
+
         return stats
-        
+
     except Exception as e:
         raise HTTPException(500, f"Error calculating stats: {str(e)}")
 
+@app.get('/stats/timeseries')
+async def get_feedback_timeseries(
+    dimension: str = 'sentiment',
+    granularity: str = 'day',
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """Per-day or per-week counts for one dimension (total, sentiment, urgency, status, theme).
+
+    since/until are bucket keys: YYYY-MM-DD for days, YYYY-Www for weeks (inclusive).
+    """
+    if dimension not in ('total', 'sentiment', 'urgency', 'status', 'theme'):
+        raise HTTPException(400, "Unknown dimension")
+    if granularity not in ('day', 'week'):
+        raise HTTPException(400, "granularity must be day or week")
+    try:
+        with STORAGE_SECONDS.time(operation='load_stats'):
+            rows = get_db().execute(
+                'SELECT bucket, value, count FROM feedback_counters '
+                'WHERE dimension = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket',
+                (dimension, f'{granularity}:{since or ""}', f'{granularity}:{until or "~"}')
+            ).fetchall()
+    except Exception as e:
+        raise HTTPException(500, f"Error loading time series: {str(e)}")
+
+    series = {}
+    for row in rows:
+        if row['count']:
+            series.setdefault(row['bucket'].split(':', 1)[1], {})[row['value']] = row['count']
+    return {
+        "dimension": dimension,
+        "granularity": granularity,
+        "series": [{"bucket": bucket, "counts": counts} for bucket, counts in series.items()]
+    }
+
+@app.get('/changes')
+async def get_changes(since: int = 0, limit: int = CHANGES_PAGE_SIZE):
+    """Changes after sequence number since (submit rows carry the full record).
+
+    Start from the change_seq returned by /feedback; if reset is true the log
+    no longer reaches back that far and the client should reload /feedback.
+    """
+    try:
+        return _read_changes(since, max(1, min(limit, CHANGES_PAGE_SIZE)))
+    except Exception as e:
+        raise HTTPException(500, f"Error loading changes: {str(e)}")
+
+@app.get('/changes/stream')
+async def stream_changes(since: int = 0, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events feed of changes after since (or the Last-Event-ID on reconnect)"""
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def events():
+        seq = since
+        idle = 0.0
+        # Starlette cancels this generator when the client disconnects
+        while True:
+            # Taken before reading so a commit in between still wakes us
+            signal = _changes_signal
+            batch = _read_changes(seq)
+            if batch['reset']:
+                yield f'event: reset\ndata: {json.dumps({"last_seq": batch["last_seq"]})}\n\n'
+            for change in batch['changes']:
+                yield f'id: {change["seq"]}\nevent: change\ndata: {json.dumps(change, ensure_ascii=False)}\n\n'
+            seq = batch['last_seq']
+            if batch['more']:
+                continue
+            try:
+                await asyncio.wait_for(signal.wait(), CHANGES_POLL_SECONDS)
+                idle = 0.0
+            except asyncio.TimeoutError:
+                idle += CHANGES_POLL_SECONDS
+                if idle >= CHANGES_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ': keepalive\n\n'
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.get('/health')
 async def health_check():
     """Health check endpoint"""
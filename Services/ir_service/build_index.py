@@ -1,11 +1,18 @@
-import os, json
+import os, re, json, math, hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
 try:
     from openai import OpenAI
-    from openai import RateLimitError
+    from openai import OpenAIError
 except Exception:
     OpenAI = None
-    RateLimitError = Exception
+    OpenAIError = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except Exception:
+    SentenceTransformer = None
 
 load_dotenv = lambda: None
 try:
@@ -21,43 +28,252 @@ if OpenAI is not None and os.getenv('OPENAI_API_KEY'):
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 INDEX_PATH = os.path.join(os.path.dirname(__file__), 'index.json')
 EMB_PATH = os.path.join(os.path.dirname(__file__), 'emb.npy')
+# Content hashes and embedder identity of the last build, used to skip
+# re-embedding files that did not change
+MANIFEST_PATH = os.path.join(os.path.dirname(__file__), 'manifest.json')
+# BM25 inverted index over the same passages (postings stored as flat arrays)
+BM25_PATH = os.path.join(os.path.dirname(__file__), 'bm25.npz')
+BM25_VOCAB_PATH = os.path.join(os.path.dirname(__file__), 'bm25_vocab.json')
+
+# auto: local model if IR_LOCAL_EMBED_MODEL is set, else OpenAI, else offline
+EMBED_BACKEND = os.getenv('IR_EMBED_BACKEND', 'auto').strip().lower()
+OPENAI_EMBED_MODEL = os.getenv('IR_EMBED_MODEL', 'text-embedding-3-small')
+LOCAL_EMBED_MODEL = os.getenv('IR_LOCAL_EMBED_MODEL', '')
+EMBED_BATCH_SIZE = int(os.getenv('IR_EMBED_BATCH_SIZE', '64'))
+EMBED_CONCURRENCY = int(os.getenv('IR_EMBED_CONCURRENCY', '4'))
+FALLBACK_DIM = 384
+# Documents are split into overlapping word windows instead of being truncated
+PASSAGE_WORDS = int(os.getenv('IR_PASSAGE_WORDS', '120'))
+PASSAGE_OVERLAP = int(os.getenv('IR_PASSAGE_OVERLAP', '30'))
+BM25_K1 = float(os.getenv('IR_BM25_K1', '1.2'))
+BM25_B = float(os.getenv('IR_BM25_B', '0.75'))
+
+TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'will', 'with'
+}
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+def chunk_text(text: str) -> list[str]:
+    """Split text into passages of PASSAGE_WORDS words overlapping by PASSAGE_OVERLAP"""
+    spans = [m.span() for m in re.finditer(r'\S+', text)]
+    if not spans:
+        return []
+    step = max(1, PASSAGE_WORDS - PASSAGE_OVERLAP)
+    passages = []
+    for start in range(0, len(spans), step):
+        window = spans[start:start + PASSAGE_WORDS]
+        passages.append(text[window[0][0]:window[-1][1]])
+        if start + PASSAGE_WORDS >= len(spans):
+            break
+    return passages
+
+class OpenAIEmbedder:
+    def __init__(self, model: str):
+        self.id = f'openai:{model}'
+        self.model = model
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        resp = client.embeddings.create(model=self.model, input=texts)
+        rows = sorted(resp.data, key=lambda d: d.index)
+        return np.array([d.embedding for d in rows], dtype='float32')
 
-os.makedirs(DATA_DIR, exist_ok=True)
-
-corpus = []
-for fname in os.listdir(DATA_DIR):
-    path = os.path.join(DATA_DIR, fname)
-    if not os.path.isfile(path):
-        continue
-    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-        text = f.read()
-    corpus.append({'doc_id': fname, 'title': fname, 'text': text[:4000]})
-
-# Offline mode if no client or explicitly requested
-OFFLINE = client is None or os.getenv('IR_OFFLINE', '').strip() == '1'
-
-if OFFLINE:
-    with open(INDEX_PATH, 'w', encoding='utf-8') as f:
-        json.dump(corpus, f, ensure_ascii=False)
-    import numpy as np
-    np.save(EMB_PATH, np.zeros((len(corpus), 384), dtype='float32'))
-    print('Built fallback index (offline mode) for', len(corpus))
-else:
+class LocalEmbedder:
+    """sentence-transformers model loaded from a local path (or cached name); no network needed"""
+
+    def __init__(self, path: str):
+        self.id = f'local:{os.path.basename(os.path.normpath(path))}'
+        self.model = SentenceTransformer(path, device='cpu')
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False
+        ).astype('float32')
+
+def get_embedder():
+    """Embedding backend selected by IR_EMBED_BACKEND; None means offline (zero vectors)"""
+    backend = EMBED_BACKEND
+    if os.getenv('IR_OFFLINE', '').strip() == '1' or backend == 'none':
+        return None
+    if backend in ('auto', 'local') and LOCAL_EMBED_MODEL and SentenceTransformer is not None:
+        try:
+            return LocalEmbedder(LOCAL_EMBED_MODEL)
+        except Exception as e:
+            print('Local embedding model failed to load:', str(e))
+    if backend in ('auto', 'openai') and client is not None:
+        return OpenAIEmbedder(OPENAI_EMBED_MODEL)
+    return None
+
+def read_corpus() -> list[dict]:
+    """One entry per data file with its passages and content hash"""
+    corpus = []
+    for fname in sorted(os.listdir(DATA_DIR)):
+        path = os.path.join(DATA_DIR, fname)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+        corpus.append({
+            'file': fname,
+            'passages': chunk_text(text),
+            'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        })
+    return corpus
+
+def build_bm25(passages: list[str]):
+    """Inverted index with precomputed per-posting BM25 weights.
+
+    Postings for term id t are docs[offsets[t]:offsets[t + 1]] with matching
+    weights, so a query is a handful of slice-and-add operations.
+    """
+    n = len(passages)
+    vocab: dict[str, int] = {}
+    postings: list[dict[int, int]] = []
+    doc_len = np.zeros(n, dtype='int32')
+    for i, text in enumerate(passages):
+        tokens = tokenize(text)
+        doc_len[i] = len(tokens)
+        for tok in tokens:
+            tid = vocab.setdefault(tok, len(vocab))
+            if tid == len(postings):
+                postings.append({})
+            postings[tid][i] = postings[tid].get(i, 0) + 1
+
+    avgdl = float(doc_len.mean()) if n else 0.0
+    offsets = np.zeros(len(postings) + 1, dtype='int64')
+    np.cumsum([len(p) for p in postings], out=offsets[1:])
+    docs = np.empty(int(offsets[-1]), dtype='int32')
+    weights = np.empty(int(offsets[-1]), dtype='float32')
+    for tid, plist in enumerate(postings):
+        s, e = offsets[tid], offsets[tid + 1]
+        ids = np.fromiter(plist.keys(), dtype='int32', count=len(plist))
+        tf = np.fromiter(plist.values(), dtype='float32', count=len(plist))
+        idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[ids] / (avgdl or 1.0))
+        docs[s:e] = ids
+        weights[s:e] = idf * tf * (BM25_K1 + 1) / (tf + norm)
+    terms = [None] * len(vocab)
+    for tok, tid in vocab.items():
+        terms[tid] = tok
+    return terms, offsets, docs, weights
+
+def load_manifest() -> dict:
     try:
-        embs = []
-        for doc in corpus:
-            resp = client.embeddings.create(model='text-embedding-3-small', input=doc['text'])
-            embs.append(resp.data[0].embedding)
-        import numpy as np
-        np.save(EMB_PATH, np.array(embs, dtype='float32'))
-        with open(INDEX_PATH, 'w', encoding='utf-8') as f:
-            json.dump(corpus, f, ensure_ascii=False)
-        print('Indexed', len(corpus))
-    except (RateLimitError, Exception) as e:
-        # Fallback on any API failure (e.g., quota exceeded)
-        print('Embedding build failed, falling back to offline index:', str(e))
-        import numpy as np
-        np.save(EMB_PATH, np.zeros((len(corpus), 384), dtype='float32'))
-        with open(INDEX_PATH, 'w', encoding='utf-8') as f:
-            json.dump(corpus, f, ensure_ascii=False)
-        print('Built fallback index for', len(corpus))
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+# What one failed embedding batch may raise: OpenAI API errors (rate limits,
+# timeouts, connection), model/runtime errors from sentence-transformers, or
+# unreadable model files. Anything else is a bug and stops the build.
+EMBED_ERRORS = (RuntimeError, ValueError, OSError) + ((OpenAIError,) if OpenAIError is not None else ())
+
+def embed_texts(embedder, texts: list[str]) -> list:
+    """Embed in batches with bounded concurrency; failed batches yield None rows"""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+
+    def run(batch):
+        try:
+            return list(embedder.embed(batch))
+        except EMBED_ERRORS as e:
+            print('Embedding batch failed:', str(e))
+            return [None] * len(batch)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as pool:
+        for out in pool.map(run, batches):
+            rows.extend(out)
+    return rows
+
+def _atomic_write_json(path: str, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _atomic_save_npy(path: str, arr: np.ndarray):
+    tmp = f'{path}.tmp.npy'
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+def _atomic_save_npz(path: str, **arrays):
+    tmp = f'{path}.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def build():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    corpus = read_corpus()
+    embedder = get_embedder()
+    embedder_id = embedder.id if embedder is not None else 'none'
+
+    chunking = {'words': PASSAGE_WORDS, 'overlap': PASSAGE_OVERLAP}
+
+    # Reuse rows from the previous build when the file hash, chunking and embedder match
+    manifest = load_manifest()
+    previous = {}
+    prev_emb = None
+    if (manifest.get('embedder') == embedder_id and manifest.get('chunking') == chunking
+            and embedder is not None and os.path.exists(EMB_PATH)):
+        try:
+            prev_emb = np.load(EMB_PATH, mmap_mode='r')
+            previous = manifest.get('files', {})
+        except Exception:
+            prev_emb = None
+
+    passages = []
+    files = {}
+    for doc in corpus:
+        start = len(passages)
+        for n, text in enumerate(doc['passages']):
+            passages.append({'doc_id': f"{doc['file']}#{n}", 'title': doc['file'], 'source': doc['file'], 'text': text})
+        files[doc['file']] = {'sha256': doc['sha256'], 'rows': [start, len(passages)], 'embedded': False}
+
+    rows = [None] * len(passages)
+    todo = []
+    for doc in corpus:
+        cur, prev = files[doc['file']], previous.get(doc['file'])
+        start, end = cur['rows']
+        if (prev and prev.get('sha256') == doc['sha256'] and prev.get('embedded')
+                and prev['rows'][1] - prev['rows'][0] == end - start and prev['rows'][1] <= len(prev_emb)):
+            for offset in range(end - start):
+                rows[start + offset] = np.asarray(prev_emb[prev['rows'][0] + offset], dtype='float32')
+        else:
+            todo.extend(range(start, end))
+
+    if embedder is not None and todo:
+        for i, vec in zip(todo, embed_texts(embedder, [passages[i]['text'] for i in todo])):
+            rows[i] = vec
+
+    dim = next((len(r) for r in rows if r is not None), FALLBACK_DIM)
+    emb = np.zeros((len(passages), dim), dtype='float32')
+    for i, row in enumerate(rows):
+        if row is not None:
+            emb[i] = row
+    # Files with any failed passage keep zero rows and are retried next build
+    for info in files.values():
+        start, end = info['rows']
+        info['embedded'] = all(rows[i] is not None for i in range(start, end))
+
+    terms, offsets, docs, weights = build_bm25([p['text'] for p in passages])
+
+    _atomic_save_npy(EMB_PATH, emb)
+    _atomic_save_npz(BM25_PATH, offsets=offsets, docs=docs, weights=weights)
+    _atomic_write_json(BM25_VOCAB_PATH, terms)
+    # The manifest goes before index.json, which the service treats as the last file of a build
+    _atomic_write_json(MANIFEST_PATH, {'embedder': embedder_id, 'dim': dim, 'chunking': chunking, 'files': files})
+    _atomic_write_json(INDEX_PATH, passages)
+
+    failed = sum(1 for r in rows if r is None)
+    if embedder is None:
+        print(f'Built fallback index (offline mode, BM25 only) for {len(corpus)} files, {len(passages)} passages')
+    else:
+        print(f'Indexed {len(corpus)} files, {len(passages)} passages ({len(todo)} embedded, '
+              f'{len(passages) - len(todo)} reused, {failed} failed) with {embedder_id}')
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,250 @@
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+import os, json, time, asyncio
+from functools import lru_cache
+import numpy as np
+from dotenv import load_dotenv
+from shared.schemas import IRDoc, IRResult
+from shared import metrics
+from Services.ir_service.build_index import (
+    get_embedder, load_manifest, tokenize, BM25_PATH, BM25_VOCAB_PATH, MANIFEST_PATH
+)
+
+load_dotenv = lambda: None
+try:
+    from dotenv import load_dotenv as _ld
+    _ld()
+except Exception:
+    pass
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), 'index.json')
+EMB_PATH = os.path.join(os.path.dirname(__file__), 'emb.npy')
+# Row-normalized copy of emb.npy; written once, then memory-mapped read-only
+# by every worker so the page cache holds a single shared copy.
+NORM_PATH = os.path.join(os.path.dirname(__file__), 'emb.norm.npy')
+RELOAD_INTERVAL = float(os.getenv('IR_RELOAD_INTERVAL', '5'))
+SNIPPET_CHARS = int(os.getenv('IR_SNIPPET_CHARS', '300'))
+# Weight of the cosine score in the fused ranking; BM25 gets the rest
+HYBRID_WEIGHT = float(os.getenv('IR_HYBRID_WEIGHT', '0.5'))
+
+app = FastAPI(title='IR Service (hybrid BM25 + vector search)')
+metrics.instrument(app, 'ir-service')
+
+class SearchIn(BaseModel):
+    query: str
+    k: int = 5
+
+# Files a loadable index needs; the manifest (embedder id) is optional but
+# part of the signature, so a reload also picks up an embedder change
+INDEX_FILES = (INDEX_PATH, EMB_PATH, BM25_PATH, BM25_VOCAB_PATH)
+
+def _signature() -> tuple:
+    """Identity of the on-disk index; changes whenever the builder rewrites it"""
+    sig = []
+    for path in INDEX_FILES + (MANIFEST_PATH,):
+        try:
+            st = os.stat(path)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+def _normalized_matrix() -> np.ndarray:
+    """Memory-map the normalized embeddings, (re)writing the sidecar if stale"""
+    raw = np.load(EMB_PATH, mmap_mode='r')
+    try:
+        if os.stat(NORM_PATH).st_mtime_ns >= os.stat(EMB_PATH).st_mtime_ns:
+            norm = np.load(NORM_PATH, mmap_mode='r')
+            if norm.shape == raw.shape and norm.dtype == np.float32:
+                return norm
+    except OSError:
+        pass
+
+    # raw is a read-only memory map; normalize a writable in-memory copy
+    mat = np.array(raw, dtype=np.float32, order='C')
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    # Zero rows (offline/fallback builds) stay zero instead of becoming NaN
+    np.divide(mat, norms, out=mat, where=norms > 0)
+    tmp = f'{NORM_PATH}.{os.getpid()}.tmp.npy'
+    np.save(tmp, mat)
+    os.replace(tmp, NORM_PATH)
+    return np.load(NORM_PATH, mmap_mode='r')
+
+class BM25Index:
+    """Postings loaded from bm25.npz; weights are precomputed BM25 contributions"""
+
+    def __init__(self, vocab: dict[str, int], offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+
+    @classmethod
+    def load(cls):
+        with open(BM25_VOCAB_PATH, 'r', encoding='utf-8') as f:
+            terms = json.load(f)
+        with np.load(BM25_PATH) as z:
+            return cls({t: i for i, t in enumerate(terms)}, z['offsets'], z['docs'], z['weights'])
+
+    def scores(self, query: str, n: int) -> np.ndarray:
+        out = np.zeros(n, dtype=np.float32)
+        for tok in set(tokenize(query)):
+            tid = self.vocab.get(tok)
+            if tid is None:
+                continue
+            s, e = self.offsets[tid], self.offsets[tid + 1]
+            # Doc ids are unique within one term's postings, so plain += is safe
+            out[self.docs[s:e]] += self.weights[s:e]
+        return out
+
+class SearchIndex:
+    """Passages, a contiguous (n, dim) float32 matrix of unit vectors and a BM25 index"""
+
+    def __init__(self, docs: list[dict], matrix: np.ndarray, bm25: BM25Index | None, signature: tuple):
+        self.docs = docs
+        self.matrix = matrix
+        self.bm25 = bm25
+        self.signature = signature
+        self.loaded_at = time.time()
+        # Offline builds write all-zero vectors; those indexes are searched with BM25 only
+        self.has_vectors = bool(len(docs)) and bool(np.any(matrix))
+        self.embedder = load_manifest().get('embedder') if docs else None
+
+    @classmethod
+    def empty(cls, signature=None):
+        return cls([], np.zeros((0, 0), dtype=np.float32), None, signature)
+
+    @classmethod
+    def load(cls):
+        signature = _signature()
+        if None in signature[:len(INDEX_FILES)]:
+            return cls.empty(signature)
+        with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        matrix = _normalized_matrix()
+        if matrix.shape[0] != len(docs):
+            raise ValueError(f'index.json has {len(docs)} passages but emb.npy has {matrix.shape[0]} rows')
+        return cls(docs, matrix, BM25Index.load(), signature)
+
+    def search(self, query: str, qvec: np.ndarray | None, k: int) -> list[tuple[int, float]]:
+        n = len(self.docs)
+        if n == 0 or k <= 0:
+            return []
+        scores = self.bm25.scores(query, n) if self.bm25 is not None else np.zeros(n, dtype=np.float32)
+        use_vectors = self.has_vectors and qvec is not None and qvec.shape[0] == self.matrix.shape[1]
+        if use_vectors:
+            top_bm25 = scores.max()
+            if top_bm25 > 0:
+                scores /= top_bm25
+            scores = HYBRID_WEIGHT * (self.matrix @ qvec) + (1 - HYBRID_WEIGHT) * scores
+            candidates = np.arange(n)
+        else:
+            # BM25 only: passages sharing no query term are not hits
+            candidates = np.flatnonzero(scores > 0)
+            if candidates.size == 0:
+                return []
+        k = min(k, candidates.size)
+        cand_scores = scores[candidates]
+        top = np.argpartition(-cand_scores, k - 1)[:k] if k < candidates.size else np.arange(candidates.size)
+        top = top[np.argsort(-cand_scores[top])]
+        return [(int(candidates[i]), float(cand_scores[i])) for i in top]
+
+index = SearchIndex.empty()
+
+def reload_index() -> bool:
+    global index
+    if _signature() == index.signature:
+        return False
+    index = SearchIndex.load()
+    print(f'IR Service: loaded {len(index.docs)} passages (vectors: {index.has_vectors})')
+    return True
+
+# Queries must be embedded by the same backend that built the index
+embedder = None
+
+@lru_cache(maxsize=1024)
+def _embed_query(query: str):
+    vec = np.asarray(embedder.embed([query])[0], dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+metrics.counter(
+    'ir_query_embedding_cache_total', 'Query embedding cache lookups', ('outcome',),
+    fn=lambda: {('hit',): _embed_query.cache_info().hits, ('miss',): _embed_query.cache_info().misses}
+)
+
+def embed_query(query: str, embedder_id: str | None):
+    if embedder is None or embedder.id != embedder_id:
+        return None
+    try:
+        return _embed_query(query)
+    except Exception as e:
+        print(f'IR Service: query embedding failed: {e}')
+        return None
+
+async def _watch_index():
+    # Hot reload: pick up files rewritten by build_index.py without a restart
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            await loop.run_in_executor(None, reload_index)
+        except Exception as e:
+            print(f'IR Service: reload failed, keeping previous index: {e}')
+
+@app.on_event('startup')
+async def load_index():
+    global embedder
+    embedder = get_embedder()
+    try:
+        reload_index()
+    except Exception as e:
+        print(f'IR Service: failed to load index: {e}')
+    if RELOAD_INTERVAL > 0:
+        asyncio.create_task(_watch_index())
+
+def rank(current: SearchIndex, query: str, k: int) -> list[tuple[int, float]]:
+    """Embed the query and rank passages; blocking, so it runs off the event loop"""
+    with metrics.MODEL_SECONDS.time(model='ir-query-embedding'):
+        qvec = embed_query(query, current.embedder) if current.has_vectors else None
+    with metrics.MODEL_SECONDS.time(model='ir-search'):
+        return current.search(query, qvec, k)
+
+@app.post('/search', response_model=IRResult)
+async def search(inp: SearchIn):
+    current = index
+    ranked = await asyncio.get_running_loop().run_in_executor(None, rank, current, inp.query, inp.k)
+    results = []
+    for i, score in ranked:
+        doc = current.docs[i]
+        results.append(IRDoc(
+            doc_id=doc['doc_id'],
+            title=doc.get('title', doc['doc_id']),
+            snippet=doc.get('text', '')[:SNIPPET_CHARS],
+            score=score,
+            url=doc.get('url')
+        ))
+    return IRResult(query=inp.query, results=results)
+
+@app.post('/reload')
+async def reload():
+    """Force a reload check of index.json / emb.npy"""
+    try:
+        changed = await asyncio.get_running_loop().run_in_executor(None, reload_index)
+    except Exception as e:
+        raise HTTPException(500, f'Error reloading index: {e}')
+    return {'reloaded': changed, 'passages': len(index.docs)}
+
+@app.get('/health')
+async def health_check():
+    """Health check endpoint"""
+    return {
+        'status': 'healthy',
+        'service': 'ir-service',
+        'passages': len(index.docs),
+        'vocab': len(index.bm25.vocab) if index.bm25 is not None else 0,
+        'dim': int(index.matrix.shape[1]) if index.matrix.ndim == 2 else 0,
+        'has_vectors': index.has_vectors,
+        'embedder': index.embedder,
+        'loaded_at': index.loaded_at,
+    }
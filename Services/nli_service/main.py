@@ -0,0 +1,62 @@
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+import os
+import asyncio
+from shared.nli import SharedNLI, URGENCY_LABELS, URGENCY_TEMPLATE, THEME_TEMPLATE
+from shared.inference import InferenceExecutor, InferenceBusy, PRELOAD_BEFORE_FORK
+from shared import metrics
+
+load_dotenv = lambda: None
+try:
+    from dotenv import load_dotenv as _ld
+    _ld()
+except Exception:
+    pass
+
+app = FastAPI(title='NLI Model Server (shared zero-shot classifier)')
+metrics.instrument(app, 'nli-service')
+
+# One model for the urgency and NLP agents (set NLI_URL on both to this
+# service). Each request scores only its own label set; results are cached
+# per set and text, so repeated texts skip the model.
+nli = SharedNLI()
+nli.register('urgency', URGENCY_LABELS, URGENCY_TEMPLATE)
+
+# Requests wait on the model lock inside SharedNLI; a few threads let cache
+# hits and waiters proceed while one forward pass runs.
+inference = InferenceExecutor('nli', threads=int(os.getenv('NLI_SERVICE_THREADS', '4')))
+
+if PRELOAD_BEFORE_FORK:
+    nli.load()
+
+class ClassifyIn(BaseModel):
+    texts: list[str]
+    label_set: str
+    labels: list[str] | None = None
+    template: str | None = None
+
+@app.on_event('startup')
+async def load_model():
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, nli.load)
+    except Exception as e:
+        print(f'NLI Service: failed to load model: {e}')
+
+@app.post('/classify')
+async def classify(inp: ClassifyIn):
+    if inp.labels is None and inp.label_set not in nli.label_sets:
+        raise HTTPException(400, f'Unknown label set: {inp.label_set}')
+    try:
+        results = await inference.run(
+            nli.classify, inp.texts, inp.label_set, inp.labels, inp.template or THEME_TEMPLATE
+        )
+    except InferenceBusy as e:
+        raise HTTPException(503, str(e))
+    except Exception as e:
+        raise HTTPException(503, f'NLI model unavailable: {e}')
+    return {'results': results, 'model': nli.model_name}
+
+@app.get('/health')
+async def health_check():
+    """Health check endpoint"""
+    return {'status': 'healthy', 'service': 'nli-service', **nli.stats(), 'inference': inference.stats()}
@@ -1,8 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
+import json
 from dotenv import load_dotenv
-import torch
+import asyncio
+from shared.models import ModelRegistry, hf_login, hf_device
+from shared.nli import get_nli, NLI_MODEL, THEME_TEMPLATE
+from shared.onnx_backend import load_pipeline
+from shared.keywords import KeywordConfig
+from shared.inference import InferenceExecutor, InferenceBusy, PRELOAD_BEFORE_FORK
+from shared import metrics
 
 try:
     from openai import OpenAI
@@ -11,16 +19,13 @@ except Exception:
 
 try:
     from transformers import pipeline
-    from huggingface_hub import login
 except Exception:
     pipeline = None
-    login = None
 
 try:
     import spacy
-    nlp = spacy.load('en_core_web_sm')
 except Exception:
-    nlp = None
+    spacy = None
 
 load_dotenv = lambda: None
 try:
@@ -34,14 +39,16 @@ if OpenAI is not None and os.getenv('OPENAI_API_KEY'):
     client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 app = FastAPI(title='NLP Agent (HF summarization + spaCy, OpenAI fallback)')
+metrics.instrument(app, 'nlp-agent')
 
 class Inp(BaseModel):
     text: str
 
-# Optional: Zero-shot classifier for theme labeling (configurable)
-classifier = None
+# Theme labels for the zero-shot classifier (configurable)
 classifier_labels: list[str] = []
-classifier_model_name = os.getenv('NLP_CLASSIFIER_MODEL', 'facebook/bart-large-mnli')
+# Zero-shot themes share one NLI model with the urgency agent (see shared.nli)
+classifier_model_name = NLI_MODEL
+summarizer_model_name = os.getenv('NLP_SUMMARIZER_MODEL', 'sshleifer/distilbart-cnn-12-6')
 labels_env = os.getenv('NLP_CLASSIFIER_LABELS', '')
 if labels_env:
     classifier_labels = [lbl.strip() for lbl in labels_env.split(',') if lbl.strip()]
@@ -52,104 +59,271 @@ else:
         'Career Growth', 'Work-life Balance', 'Recognition', 'Communication', 'Other'
     ]
 
-try:
-    if pipeline is not None and classifier_labels:
-        hf_token = (
-            os.getenv('HUGGINGFACE_TOKEN')
-            or os.getenv('HUGGINGFACEHUB_API_TOKEN')
-            or os.getenv('HF_TOKEN')
-        )
-        if hf_token and login is not None:
-            try:
-                os.environ['HUGGINGFACEHUB_API_TOKEN'] = hf_token
-                login(token=hf_token)
-            except Exception:
-                pass
-
-        classifier = pipeline(
-            'zero-shot-classification',
-            model=classifier_model_name,
-            device=0 if torch.cuda.is_available() else -1
-        )
-except Exception:
-    classifier = None
+# Cheap tier of the theme cascade: keyword rules per label. A text whose top
+# label wins by a clear margin skips the zero-shot classifier. Terms weigh 1.0
+# unless given; NLP_THEME_KEYWORDS_FILE (JSON, same shape) overrides and is
+# hot-reloaded. Labels not in classifier_labels are ignored.
+DEFAULT_THEME_KEYWORDS = {
+    'Compensation': {'salary': 2, 'pay': 1, 'paid': 1, 'raise': 1, 'bonus': 2, 'compensation': 2, 'wage': 2, 'wages': 2, 'underpaid': 2},
+    'Workload': {'workload': 2, 'overtime': 2, 'deadlines': 1, 'understaffed': 2, 'too much work': 2, 'overworked': 2},
+    'Management': {'manager': 1, 'management': 1, 'supervisor': 1, 'micromanage': 2, 'micromanagement': 2, 'leadership': 1},
+    'Culture': {'culture': 2, 'toxic': 1, 'team spirit': 2, 'inclusive': 1, 'inclusion': 1, 'diversity': 1},
+    'Benefits': {'benefits': 2, 'insurance': 2, 'pension': 2, 'health plan': 2, '401k': 2, 'parental leave': 2, 'perks': 1},
+    'Career Growth': {'promotion': 2, 'career': 1, 'training': 1, 'mentorship': 2, 'growth': 1, 'learning': 1},
+    'Work-life Balance': {'work-life balance': 2, 'work life balance': 2, 'remote': 1, 'flexible hours': 2, 'weekends': 1, 'burnout': 1},
+    'Recognition': {'recognition': 2, 'recognized': 2, 'appreciated': 2, 'unappreciated': 2, 'credit': 1, 'praise': 1},
+    'Communication': {'communication': 2, 'informed': 1, 'transparency': 2, 'meetings': 1, 'updates': 1},
+}
+theme_keywords = KeywordConfig(
+    os.getenv('NLP_THEME_KEYWORDS_FILE'),
+    DEFAULT_THEME_KEYWORDS,
+    check_interval=float(os.getenv('NLP_THEME_KEYWORDS_RELOAD_SECONDS', '5'))
+)
+CASCADE_ENABLED = os.getenv('NLP_CASCADE', '1').strip() == '1'
+CASCADE_THRESHOLD = float(os.getenv('NLP_CASCADE_THRESHOLD', '0.8'))
+# Which tier classified each text: keyword rules, zero-shot model, or neither
+tier_counts = {'keywords': 0, 'model': 0, 'none': 0}
+metrics.counter(
+    'theme_cascade_total', 'Texts classified per cascade tier', ('tier',),
+    fn=lambda: {(tier,): n for tier, n in tier_counts.items()}
+)
+
+def keyword_classification(text: str) -> dict | None:
+    """Classification from keyword rules, or None when no label matched"""
+    hits = {label: h for label, h in theme_keywords.matcher.scan(text).items() if label in classifier_labels}
+    if not hits:
+        return None
+    ranked = sorted(hits.items(), key=lambda kv: kv[1]['score'], reverse=True)
+    top_label, top = ranked[0]
+    runner_up = ranked[1][1]['score'] if len(ranked) > 1 else 0.0
+    total = sum(h['score'] for _, h in ranked)
+    # Confidence grows with the margin over the next label, not the raw count
+    confidence = min(0.95, 0.5 + 0.15 * (top['score'] - runner_up))
+    return {
+        'label': top_label,
+        'score': round(confidence, 3),
+        # Share of matched keyword weight per label, comparable to the model's scores map
+        'scores': {label: round(h['score'] / total, 3) for label, h in ranked},
+        'model': 'keywords',
+        'matched': top['terms'],
+    }
+
+# Models are loaded once per process and shared by all requests
+models = ModelRegistry()
+
+def _load_summarizer():
+    if pipeline is None:
+        return None
+    hf_login()
+    # INFERENCE_BACKEND=onnx serves it from a quantized ONNX Runtime export
+    return load_pipeline(
+        'summarization', summarizer_model_name, device=hf_device(),
+        parity_kwargs={'max_length': 40, 'min_length': 8, 'do_sample': False}
+    )
+
+def _load_classifier():
+    if not classifier_labels:
+        return None
+    nli = get_nli()
+    if nli is None:
+        return None
+    nli.register('themes', classifier_labels, THEME_TEMPLATE)
+    return nli.load()
+
+def _load_spacy():
+    if spacy is None:
+        return None
+    return spacy.load(os.getenv('NLP_SPACY_MODEL', 'en_core_web_sm'))
+
+WARMUP_TEXT = 'The new scheduling process has made my workload hard to manage this month.'
+
+models.register('summarizer', _load_summarizer,
+                warmup=lambda m: m(WARMUP_TEXT, max_length=40, min_length=8, do_sample=False))
+models.register('classifier', _load_classifier,
+                warmup=lambda m: m.classify([WARMUP_TEXT], 'themes'))
+models.register('spacy', _load_spacy, warmup=lambda m: m(WARMUP_TEXT))
+
+# Under gunicorn with preload_app the weights are loaded here, in the master,
+# and shared with the forked workers; warm-up still runs in each worker.
+if PRELOAD_BEFORE_FORK and os.getenv('NLP_PRELOAD', '1').strip() == '1':
+    models.preload()
+
+# Summarizer, spaCy and classifier calls run here instead of on the event loop
+inference = InferenceExecutor('nlp')
+
+@app.on_event('startup')
+async def preload_models():
+    # NLP_PRELOAD=0 defers loading to the first request that needs each model
+    if os.getenv('NLP_PRELOAD', '1').strip() == '1':
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, models.preload)
+        if os.getenv('NLP_WARMUP', '1').strip() == '1':
+            await loop.run_in_executor(None, models.warmup)
+
+@app.get('/models')
+async def model_stats():
+    """Load time, memory and warm-up state per model, plus theme cascade tier counts"""
+    total = sum(tier_counts.values())
+    return {
+        'models': models.stats(),
+        'inference': inference.stats(),
+        'cascade': {
+            'enabled': CASCADE_ENABLED,
+            'threshold': CASCADE_THRESHOLD,
+            'tiers': dict(tier_counts),
+            'keyword_rate': round(tier_counts['keywords'] / total, 3) if total else 0.0,
+        },
+    }
+
+# Batch sizes for /themes/batch; chunks are processed and streamed in order
+SUMMARY_BATCH_SIZE = int(os.getenv('NLP_SUMMARY_BATCH_SIZE', '8'))
+SPACY_BATCH_SIZE = int(os.getenv('NLP_SPACY_BATCH_SIZE', '64'))
+SPACY_PROCESSES = int(os.getenv('NLP_SPACY_PROCESSES', '1'))
+BATCH_CHUNK_SIZE = int(os.getenv('NLP_BATCH_CHUNK_SIZE', '64'))
+
+class BatchInp(BaseModel):
+    texts: list[str]
+    stream: bool = False
+
+def summarize_many(texts: list[str]) -> list[str]:
+    """Batched HF summaries; empty strings where the model is unavailable or fails"""
+    summarizer = models.get('summarizer')
+    if summarizer is None or not texts:
+        return [''] * len(texts)
+    metrics.BATCH_SIZE.observe(len(texts), model='summarizer')
+    try:
+        with metrics.MODEL_SECONDS.time(model='summarizer'):
+            result = summarizer(texts, max_length=40, min_length=8, do_sample=False, batch_size=SUMMARY_BATCH_SIZE)
+        return [((r[0] if isinstance(r, list) else r)['summary_text'] or '').strip() for r in result]
+    except Exception:
+        return [''] * len(texts)
+
+def entities_many(texts: list[str]) -> list[list[str]]:
+    nlp = models.get('spacy')
+    if nlp is None or not texts:
+        return [[] for _ in texts]
+    metrics.BATCH_SIZE.observe(len(texts), model='spacy')
+    try:
+        with metrics.MODEL_SECONDS.time(model='spacy'):
+            return [
+                sorted({ent.text for ent in doc.ents})
+                for doc in nlp.pipe(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_PROCESSES)
+            ]
+    except Exception:
+        return [[] for _ in texts]
+
+def classify_many(texts: list[str]) -> list[dict]:
+    """Keyword tier first when the cascade is on; only unresolved texts reach the classifier"""
+    out: list[dict | None] = [None] * len(texts)
+    if CASCADE_ENABLED and classifier_labels:
+        for i, text in enumerate(texts):
+            cheap = keyword_classification(text)
+            if cheap is not None and cheap['score'] >= CASCADE_THRESHOLD:
+                out[i] = cheap
+        tier_counts['keywords'] += sum(1 for r in out if r is not None)
+    pending = [i for i, r in enumerate(out) if r is None]
+    for i, res in zip(pending, zero_shot_many([texts[i] for i in pending])):
+        tier_counts['model' if res.get('model') == classifier_model_name else 'none'] += 1
+        out[i] = res
+    return out
+
+def zero_shot_many(texts: list[str]) -> list[dict]:
+    classifier = models.get('classifier')
+    if classifier is None or not classifier_labels or not texts:
+        return [{} for _ in texts]
+    metrics.BATCH_SIZE.observe(len(texts), model='themes')
+    try:
+        with metrics.MODEL_SECONDS.time(model='themes'):
+            res = classifier.classify(texts, 'themes', classifier_labels, THEME_TEMPLATE)
+    except Exception:
+        return [{} for _ in texts]
+    out = []
+    for r in res:
+        # Build scores map
+        scores_map = {label: float(score) for label, score in zip(r['labels'], r['scores'])}
+        out.append({
+            'label': r['labels'][0] if r.get('labels') else '',
+            'score': float(r['scores'][0]) if r.get('scores') else 0.0,
+            'scores': scores_map,
+            'model': classifier_model_name
+        })
+    return out
+
+def themes_result(text: str, summary: str, ents: list[str], classification: dict) -> dict:
+    """Response body; degraded when the summary is the truncated text or no classifier answered"""
+    res = {'summary': summary or text[:140], 'entities': ents, 'classification': classification}
+    if not summary or not classification:
+        res['degraded'] = True
+    return res
+
+def themes_many(texts: list[str]) -> list[dict]:
+    """Summary, entities and classification for a list of texts, in input order"""
+    summaries = summarize_many(texts)
+    ents = entities_many(texts)
+    classes = classify_many(texts)
+    return [themes_result(*row) for row in zip(texts, summaries, ents, classes)]
+
+def analyze_one(text: str) -> tuple[str, list[str], dict]:
+    """HF summary (may be empty), entities and classification for one text (blocking)"""
+    return summarize_many([text])[0], entities_many([text])[0], classify_many([text])[0]
+
+def openai_summary(text: str) -> str:
+    prompt = (
+        "Summarize the main themes of the following employee feedback in 1 concise sentence.\n\n"
+        + text
+        + "\n\nReturn only the summary sentence."
+    )
+    resp = client.chat.completions.create(
+        model='gpt-4o-mini',
+        messages=[{'role':'user','content':prompt}],
+        temperature=0.2
+    )
+    return (resp.choices[0].message.content or '').strip()
 
 @app.post('/themes')
 async def themes(inp: Inp):
-    summary = ''
-
     # Prefer Hugging Face summarization if available
-    used_hf = False
-    if pipeline is not None:
-        try:
-            hf_token = (
-                os.getenv('HUGGINGFACE_TOKEN')
-                or os.getenv('HUGGINGFACEHUB_API_TOKEN')
-                or os.getenv('HF_TOKEN')
-            )
-            if hf_token and login is not None:
-                try:
-                    os.environ['HUGGINGFACEHUB_API_TOKEN'] = hf_token
-                    login(token=hf_token)
-                except Exception:
-                    pass
-
-            summarizer = pipeline(
-                'summarization',
-                model='sshleifer/distilbart-cnn-12-6',
-                device=0 if torch.cuda.is_available() else -1
-            )
-            # Keep it to a single concise sentence
-            result = summarizer(inp.text, max_length=40, min_length=8, do_sample=False)
-            summary = (result[0]['summary_text'] or '').strip()
-            used_hf = True
-        except Exception:
-            used_hf = False
+    try:
+        summary, ents, classification = await inference.run(analyze_one, inp.text)
+    except InferenceBusy as e:
+        raise HTTPException(503, str(e))
 
-    # If HF unavailable, try OpenAI
-    if not used_hf and client is not None:
+    # If HF unavailable, try OpenAI (network wait, so not on the inference pool)
+    if not summary and client is not None:
         try:
-            prompt = (
-                "Summarize the main themes of the following employee feedback in 1 concise sentence.\n\n"
-                + inp.text
-                + "\n\nReturn only the summary sentence."
-            )
-            resp = client.chat.completions.create(
-                model='gpt-4o-mini',
-                messages=[{'role':'user','content':prompt}],
-                temperature=0.2
-            )
-            summary = (resp.choices[0].message.content or '').strip()
+            with metrics.MODEL_SECONDS.time(model='openai-summary'):
+                summary = await asyncio.to_thread(openai_summary, inp.text)
         except Exception:
-            summary = inp.text[:140]
+            summary = ''
 
-    # Last resort heuristic
-    if not summary:
-        summary = inp.text[:140]
+    # Last resort heuristic: the truncated text
+    return themes_result(inp.text, summary, ents, classification)
 
-    ents = []
-    if nlp is not None:
-        try:
-            doc = nlp(inp.text)
-            ents = sorted({ent.text for ent in doc.ents})
-        except Exception:
-            ents = []
-    classification = {}
-    if classifier is not None and classifier_labels:
+@app.post('/themes/batch')
+async def themes_batch(inp: BatchInp):
+    """Themes for many texts using batched model calls.
+
+    With stream=true the response is NDJSON, one {'index', ...} line per text,
+    flushed chunk by chunk as each finishes; otherwise a single JSON body.
+    """
+    chunks = [
+        (start, inp.texts[start:start + BATCH_CHUNK_SIZE])
+        for start in range(0, len(inp.texts), BATCH_CHUNK_SIZE)
+    ]
+
+    if not inp.stream:
+        results = []
         try:
-            # Use a simple template; configurable via env in the future if needed
-            res = classifier(inp.text, candidate_labels=classifier_labels, hypothesis_template='This feedback is about {}.')
-            # Build scores map
-            scores_map = {label: float(score) for label, score in zip(res['labels'], res['scores'])}
-            top_label = res['labels'][0] if res.get('labels') else ''
-            top_score = float(res['scores'][0]) if res.get('scores') else 0.0
-            classification = {
-                'label': top_label,
-                'score': top_score,
-                'scores': scores_map,
-                'model': classifier_model_name
-            }
-        except Exception:
-            classification = {}
+            for _, chunk in chunks:
+                results.extend(await inference.run(themes_many, chunk))
+        except InferenceBusy as e:
+            raise HTTPException(503, str(e))
+        return {'results': results, 'count': len(results)}
+
+    async def lines():
+        for start, chunk in chunks:
+            results = await inference.run(themes_many, chunk)
+            for offset, res in enumerate(results):
+                yield json.dumps({'index': start + offset, **res}) + '\n'
 
-    return {'summary': summary, 'entities': ents, 'classification': classification}
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
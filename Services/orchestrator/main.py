@@ -1,9 +1,22 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import io
 import os
+import csv
+import json
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv
 import httpx
-from shared.sanitize import sanitize_text
+import jwt
+from collections import OrderedDict
+from shared.sanitize import sanitize_text, sanitize_many
+from shared.cache import ResultCache, cache_key
+from shared.jobqueue import JobQueue
+from shared.urgency import heuristic_urgency
+from shared import metrics
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Header
 
@@ -20,6 +33,7 @@ NLP_URL = os.getenv('NLP_URL','http://127.0.0.1:8002')
 SUGGESTION_URL = os.getenv('SUGGESTION_URL','http://127.0.0.1:8003')
 IR_URL = os.getenv('IR_URL','http://127.0.0.1:8004')
 SEC_URL = os.getenv('SECURITY_URL','http://127.0.0.1:8005')
+STORAGE_URL = os.getenv('STORAGE_URL','http://127.0.0.1:8006')
 
 app = FastAPI(title='Orchestrator (API-first)')
 app.add_middleware(
@@ -27,63 +41,869 @@ app.add_middleware(
     allow_origins=["http://127.0.0.1:5500", "http://localhost:5500", "http://127.0.0.1:8080", "http://localhost:8080", "http://127.0.0.1:3000", "http://localhost:3000", "file://"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[metrics.TRACE_HEADER]
 )
+metrics.instrument(app, 'orchestrator')
 
 class In(BaseModel):
     text: str
 
-async def post_json(url: str, payload: dict, headers: dict | None = None):
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(url, json=payload, headers=headers)
-        r.raise_for_status()
-        return r.json()
+# Longest feedback text accepted; sanitize_text runs on the event loop and is
+# linear in its input, so this also bounds the time one request can hold it
+TEXT_MAX_CHARS = int(os.getenv('TEXT_MAX_CHARS', '20000'))
 
-async def get_json(url: str, headers: dict | None = None):
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, headers=headers)
-        r.raise_for_status()
-        return r.json()
+def clean_text(raw: str) -> str:
+    if len(raw) > TEXT_MAX_CHARS:
+        raise HTTPException(413, f'Text longer than {TEXT_MAX_CHARS} characters')
+    text = sanitize_text(raw)
+    if len(text) < 3:
+        raise HTTPException(400,'Text too short')
+    return text
 
-@app.post('/analyze')
-async def analyze(inp: In, authorization: str | None = Header(None)):
+# One long-lived client per downstream service so connections are reused
+# across requests instead of paying a TCP (and TLS) handshake per hop.
+POOL_MAX_CONNECTIONS = int(os.getenv('POOL_MAX_CONNECTIONS', '100'))
+POOL_MAX_KEEPALIVE = int(os.getenv('POOL_MAX_KEEPALIVE', '20'))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('POOL_KEEPALIVE_EXPIRY', '30'))
+HTTP2 = os.getenv('HTTP2', '0').strip() == '1'
+if HTTP2:
+    try:
+        import h2  # noqa: F401  (httpx needs it for http2=True)
+    except Exception:
+        print('Orchestrator: HTTP2=1 but the h2 package is missing, using HTTP/1.1')
+        HTTP2 = False
+
+DOWNSTREAM_SECONDS = metrics.histogram(
+    'downstream_request_duration_seconds', 'Orchestrator calls to other services', ('service', 'outcome')
+)
+
+class ServicePool:
+    """Application-lifetime httpx client for a single downstream service."""
+
+    def __init__(self, name: str, base_url: str, timeout: float):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.client: httpx.AsyncClient | None = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def open(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                http2=HTTP2,
+                # Forwards the X-Trace-Id of the request being served
+                event_hooks=metrics.httpx_hooks(),
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+                ),
+            )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(self, method: str, path: str, **kwargs):
+        if self.client is None:
+            await self.open()
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        if self.in_flight > POOL_MAX_CONNECTIONS:
+            # Requests beyond the pool size queue inside httpx for a connection
+            self.saturated += 1
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            r = await self.client.request(method, path, **kwargs)
+            r.raise_for_status()
+            return r.json()
+        except Exception:
+            self.errors += 1
+            outcome = 'error'
+            raise
+        finally:
+            self.in_flight -= 1
+            DOWNSTREAM_SECONDS.observe(time.perf_counter() - started, service=self.name, outcome=outcome)
+
+    def stats(self) -> dict:
+        return {
+            'base_url': self.base_url,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'utilization': round(self.in_flight / POOL_MAX_CONNECTIONS, 3),
+            'saturated_requests': self.saturated,
+            'requests': self.requests,
+            'errors': self.errors,
+        }
+
+SERVICES = {
+    'sentiment': ServicePool('sentiment', SENTIMENT_URL, float(os.getenv('SENTIMENT_HTTP_TIMEOUT', '60'))),
+    'urgency': ServicePool('urgency', URGENCY_URL, float(os.getenv('URGENCY_HTTP_TIMEOUT', '60'))),
+    'nlp': ServicePool('nlp', NLP_URL, float(os.getenv('NLP_HTTP_TIMEOUT', '60'))),
+    'suggestion': ServicePool('suggestion', SUGGESTION_URL, float(os.getenv('SUGGESTION_HTTP_TIMEOUT', '60'))),
+    'ir': ServicePool('ir', IR_URL, float(os.getenv('IR_HTTP_TIMEOUT', '60'))),
+    'security': ServicePool('security', SEC_URL, float(os.getenv('SECURITY_HTTP_TIMEOUT', '30'))),
+    'storage': ServicePool('storage', STORAGE_URL, float(os.getenv('STORAGE_HTTP_TIMEOUT', '30'))),
+}
+
+# Content-addressed cache of per-stage results. Keys include the stage's
+# model/config version, so bumping e.g. SUGGESTION_VERSION only invalidates
+# suggestions and leaves cached sentiment/urgency/themes intact.
+STAGE_VERSIONS = {
+    'sentiment': os.getenv('SENTIMENT_VERSION', '1'),
+    'urgency': os.getenv('URGENCY_VERSION', '1'),
+    'themes': os.getenv('NLP_VERSION', '1'),
+    'evidence': os.getenv('IR_VERSION', '1'),
+    'suggestion': os.getenv('SUGGESTION_VERSION', '1'),
+}
+cache = None
+if os.getenv('CACHE_ENABLED', '1').strip() == '1':
+    cache = ResultCache(
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+        ttl=float(os.getenv('CACHE_TTL', '86400')),
+        disk_path=os.getenv('CACHE_DISK_PATH') or None,
+        disk_max_entries=int(os.getenv('CACHE_DISK_MAX_ENTRIES', '100000')),
+    )
+# Answers an agent flags as degraded (heuristic urgency, truncated summary,
+# rule-based suggestions) are only kept this long, so the model's answer
+# replaces them once it is back; 0 does not cache them at all.
+CACHE_DEGRADED_TTL = float(os.getenv('CACHE_DEGRADED_TTL', '60'))
+
+def _cache_lookups() -> dict:
+    out = {}
+    for stage, counts in (cache.metrics if cache is not None else {}).items():
+        for outcome, n in counts.items():
+            out[(stage, outcome)] = n
+    return out
+
+metrics.counter(
+    'stage_cache_lookups_total', 'Stage result cache lookups by outcome (hits, disk_hits, misses)',
+    ('stage', 'outcome'), fn=_cache_lookups
+)
+
+def cache_result(key: str, result):
+    if isinstance(result, dict) and result.get('degraded'):
+        if CACHE_DEGRADED_TTL > 0:
+            cache.set(key, result, ttl=CACHE_DEGRADED_TTL)
+        return
+    cache.set(key, result)
+
+async def cached_call(stage: str, inputs: tuple, call):
+    """Return the cached result for (stage, version, inputs) or run call() and store it"""
+    if cache is None:
+        return await call()
+    key = cache_key(stage, STAGE_VERSIONS[stage], *inputs)
+    hit = await cache.aget(key)
+    if hit is not None:
+        return hit
+    result = await call()
+    cache_result(key, result)
+    return result
+
+@app.on_event('startup')
+async def open_pools():
+    for pool in SERVICES.values():
+        await pool.open()
+
+@app.on_event('shutdown')
+async def close_pools():
+    # Workers first, so their jobs are released rather than failed on closed clients
+    await stop_job_workers()
+    for pool in SERVICES.values():
+        await pool.close()
+    if cache is not None:
+        await asyncio.to_thread(cache.close)
+
+async def post_json(service: str, path: str, payload: dict, headers: dict | None = None):
+    return await SERVICES[service].request('POST', path, json=payload, headers=headers)
+
+async def get_json(service: str, path: str, headers: dict | None = None):
+    return await SERVICES[service].request('GET', path, headers=headers)
+
+@app.get('/health')
+async def health_check():
+    """Health check endpoint with downstream connection pool usage"""
+    return {
+        'status': 'healthy',
+        'service': 'orchestrator',
+        'http2': HTTP2,
+        'pools': {name: pool.stats() for name, pool in SERVICES.items()},
+        'cache': cache.stats() if cache is not None else None,
+        'auth': token_verifier.stats(),
+        # Queue stats only once this process has opened it
+        'jobs': {
+            'workers': len(_job_workers),
+            **(await asyncio.to_thread(_jobs.stats) if _jobs is not None else {}),
+        },
+    }
+
+# Per-stage configuration: downstream call timeout (seconds) and whether a
+# failure fails the whole request or only marks the stage in the response.
+STAGE_TIMEOUTS = {
+    'sentiment': float(os.getenv('SENTIMENT_TIMEOUT', '20')),
+    'urgency': float(os.getenv('URGENCY_TIMEOUT', '30')),
+    'themes': float(os.getenv('THEMES_TIMEOUT', '45')),
+    'evidence': float(os.getenv('IR_TIMEOUT', '10')),
+    'suggestion': float(os.getenv('SUGGESTION_TIMEOUT', '45')),
+}
+REQUIRED_STAGES = {
+    s.strip() for s in os.getenv('REQUIRED_STAGES', 'sentiment,urgency').split(',') if s.strip()
+}
+STAGE_SECONDS = metrics.histogram(
+    'pipeline_stage_duration_seconds', 'Analysis stage latency, including cache hits', ('stage', 'status')
+)
+
+class StageError(Exception):
+    """A required stage failed; carries the stage name for the 502 detail."""
+    def __init__(self, stage: str, error: str):
+        super().__init__(error)
+        self.stage = stage
+        self.error = error
+
+# Cascade: pass the sentiment result to the urgency agent as a cheap signal so
+# clear-cut texts skip its zero-shot model. Off by default: it makes urgency
+# wait for sentiment, putting both model calls on the critical path.
+CASCADE_SENTIMENT_HINT = os.getenv('CASCADE_SENTIMENT_HINT', '0').strip() == '1'
+
+def sentiment_hint(result: dict | None) -> dict | None:
+    """The label/score part of a sentiment result, as accepted by the urgency agent"""
+    if not result:
+        return None
+    label = result.get('sentiment') or result.get('label')
+    if not label or result.get('score') is None:
+        return None
+    return {'sentiment': label, 'score': result['score']}
+
+def build_stages(text: str, prefetched: dict | None = None) -> dict:
+    """Dependency graph for one /analyze call: name -> (deps, coroutine factory).
+
+    Factories receive the results of their dependencies (None when a
+    dependency failed) so optional stages can degrade instead of aborting.
+    Stages in prefetched (result or exception, e.g. from a batch call) are
+    not requested again.
+    """
+    async def sentiment(_):
+        return await cached_call('sentiment', (text,), lambda: post_json('sentiment', '/analyze', {'text': text}))
+
+    async def urgency(deps):
+        hint = sentiment_hint(deps.get('sentiment'))
+        if hint is None:
+            return await cached_call('urgency', (text,), lambda: post_json('urgency', '/detect', {'text': text}))
+        payload = {'text': text, 'sentiment': hint}
+        return await cached_call('urgency', (text, hint), lambda: post_json('urgency', '/detect', payload))
+
+    async def themes(_):
+        return await cached_call('themes', (text,), lambda: post_json('nlp', '/themes', {'text': text}))
+
+    async def evidence(deps):
+        summary = (deps.get('themes') or {}).get('summary') or text
+        return await cached_call(
+            'evidence', (summary, 5), lambda: post_json('ir', '/search', {'query': summary, 'k': 5})
+        )
+
+    async def suggestion(deps):
+        th = deps.get('themes') or {}
+        payload = {'feedback': text, 'themes': th.get('summary', ''), 'entities': th.get('entities', [])}
+        return await cached_call(
+            'suggestion', (payload,), lambda: post_json('suggestion', '/suggest', payload)
+        )
+
+    stages = {
+        'sentiment': ((), sentiment),
+        'urgency': (('sentiment',) if CASCADE_SENTIMENT_HINT else (), urgency),
+        'themes': ((), themes),
+        'evidence': (('themes',), evidence),
+        'suggestion': (('themes',), suggestion),
+    }
+    for name, value in (prefetched or {}).items():
+        async def ready(_, value=value):
+            if isinstance(value, Exception):
+                raise value
+            return value
+        stages[name] = (stages[name][0], ready)
+    return stages
+
+async def run_stages(stages: dict, on_stage=None) -> tuple[dict, dict]:
+    """Run the stage graph, starting each stage as soon as its deps settle.
+
+    Returns (results, status); a failed or timed-out required stage raises
+    StageError, optional ones are reported in status and their result is None.
+    on_stage(name, result, status), if given, is called as each stage settles.
+    """
+    tasks: dict[str, asyncio.Task] = {}
+    results: dict = {}
+    status: dict = {}
+
+    async def run(name: str):
+        deps, factory = stages[name]
+        if deps:
+            await asyncio.gather(*(tasks[d] for d in deps), return_exceptions=True)
+        started = time.perf_counter()
+        try:
+            results[name] = await asyncio.wait_for(
+                factory({d: results.get(d) for d in deps}), STAGE_TIMEOUTS.get(name, 60)
+            )
+            status[name] = {'status': 'ok'}
+        except asyncio.TimeoutError:
+            results[name] = None
+            status[name] = {'status': 'timeout', 'error': f'no response within {STAGE_TIMEOUTS.get(name, 60)}s'}
+        except Exception as e:
+            results[name] = None
+            status[name] = {'status': 'error', 'error': str(e)}
+        elapsed = time.perf_counter() - started
+        status[name]['ms'] = round(elapsed * 1000, 1)
+        STAGE_SECONDS.observe(elapsed, stage=name, status=status[name]['status'])
+        metrics.log('stage', stage=name, status=status[name]['status'], ms=status[name]['ms'])
+        if on_stage is not None:
+            on_stage(name, results[name], status[name])
+        if status[name]['status'] != 'ok' and name in REQUIRED_STAGES:
+            raise StageError(name, status[name]['error'])
+
+    for name in stages:
+        tasks[name] = asyncio.create_task(run(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except StageError:
+        for t in tasks.values():
+            t.cancel()
+        raise
+    return results, status
+
+# Local JWT verification uses only the RS256 public keys from the security
+# service's JWKS (cached, refetched on unknown kid); every other token goes
+# through the /verify round trip. Verified tokens are remembered for at most
+# TOKEN_CACHE_TTL seconds and never past their exp.
+JWKS_TTL = float(os.getenv('JWKS_TTL', '300'))
+JWKS_MIN_REFRESH = float(os.getenv('JWKS_MIN_REFRESH', '30'))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '60'))
+
+class TokenVerifier:
+    """Checks tokens locally with the public keys from the security service's JWKS.
+
+    Tokens it cannot check that way (no kid, a kid not in the JWKS, HS256
+    tokens whose secret only the security service holds) are verified by
+    its /verify endpoint. Results are cached until the token's exp or for
+    TOKEN_CACHE_TTL, whichever comes first; tokens without exp are not cached.
+    """
+
+    def __init__(self):
+        self.rs_keys: dict = {}
+        self.jwks_fetched = 0.0
+        self.verified: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.metrics = {'cache_hits': 0, 'local': 0, 'remote': 0, 'rejected': 0, 'jwks_fetches': 0}
+
+    async def refresh_keys(self, force: bool = False):
+        age = time.time() - self.jwks_fetched
+        if age < (JWKS_MIN_REFRESH if force else JWKS_TTL):
+            return
+        self.jwks_fetched = time.time()
+        try:
+            data = await get_json('security', '/.well-known/jwks.json')
+            self.rs_keys = {k['kid']: jwt.PyJWK(k).key for k in data.get('keys', []) if k.get('kid')}
+            self.metrics['jwks_fetches'] += 1
+        except Exception as e:
+            print(f'Orchestrator: JWKS fetch failed, keeping {len(self.rs_keys)} cached keys: {e}')
+
+    def _remember(self, token: str, claims: dict):
+        exp = claims.get('exp')
+        if exp is None:
+            # /verify does not echo exp; the token was just verified, so its own payload is trustworthy
+            try:
+                exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+            except jwt.PyJWTError:
+                exp = None
+        if not isinstance(exp, (int, float)):
+            return
+        until = min(float(exp), time.time() + TOKEN_CACHE_TTL)
+        if until <= time.time():
+            return
+        self.verified[token] = (until, claims)
+        self.verified.move_to_end(token)
+        while len(self.verified) > TOKEN_CACHE_SIZE:
+            self.verified.popitem(last=False)
+
+    def _decode_local(self, token: str, kid: str | None):
+        """Claims when kid names a JWKS key, None when the token must be checked remotely"""
+        key = self.rs_keys.get(kid) if kid is not None else None
+        if key is None:
+            return None
+        return jwt.decode(token, key, algorithms=['RS256'])
+
+    async def verify(self, authorization: str) -> dict:
+        token = authorization.split(' ', 1)[1].strip() if ' ' in authorization else authorization.strip()
+        hit = self.verified.get(token)
+        if hit is not None:
+            if hit[0] > time.time():
+                self.metrics['cache_hits'] += 1
+                return hit[1]
+            del self.verified[token]
+
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            await self.refresh_keys()
+            if kid is not None and kid not in self.rs_keys:
+                await self.refresh_keys(force=True)
+            claims = self._decode_local(token, kid)
+        except jwt.PyJWTError:
+            self.metrics['rejected'] += 1
+            raise
+
+        if claims is None:
+            # No local key for it (HS256, no kid, or rotated before our JWKS refresh): ask the security service
+            claims = await get_json('security', '/verify', headers={'Authorization': f'Bearer {token}'})
+            self.metrics['remote'] += 1
+        else:
+            self.metrics['local'] += 1
+        self._remember(token, claims)
+        return claims
+
+    def stats(self) -> dict:
+        total = sum(self.metrics[k] for k in ('cache_hits', 'local', 'remote'))
+        return {
+            **self.metrics,
+            'cached_tokens': len(self.verified),
+            'rs_keys': len(self.rs_keys),
+            'network_skipped_ratio': round((total - self.metrics['remote']) / total, 3) if total else 0.0,
+        }
+
+token_verifier = TokenVerifier()
+
+async def verify_authorization(authorization: str | None):
     # Verify token if provided
     if authorization:
         try:
-            await get_json(f'{SEC_URL}/verify', headers={'Authorization': authorization})
+            return await token_verifier.verify(authorization)
         except Exception as e:
             raise HTTPException(401, f'Invalid token: {e}')
 
-    text = sanitize_text(inp.text)
-    if len(text) < 3:
-        raise HTTPException(400,'Text too short')
+@app.post('/analyze')
+async def analyze(inp: In, authorization: str | None = Header(None)):
+    await verify_authorization(authorization)
 
-    try:
-        sentiment = await post_json(f'{SENTIMENT_URL}/analyze', {'text': text})
-    except Exception as e:
-        raise HTTPException(502, f'Sentiment service error: {e}')
+    text = clean_text(inp.text)
 
     try:
-        urgency = await post_json(f'{URGENCY_URL}/detect', {'text': text})
-    except Exception as e:
-        raise HTTPException(502, f'Urgency service error: {e}')
+        results, status = await run_stages(build_stages(text))
+    except StageError as e:
+        raise HTTPException(502, f'{e.stage.capitalize()} service error: {e.error}')
+
+    return analysis_response(results, status)
+
+def analysis_response(results: dict, status: dict) -> dict:
+    return {
+        **results,
+        'partial': any(s['status'] != 'ok' for s in status.values()),
+        'stages': status,
+    }
+
+def sse_event(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+@app.post('/analyze/stream')
+async def analyze_stream(inp: In, authorization: str | None = Header(None)):
+    """Same analysis as /analyze, streamed as Server-Sent Events.
+
+    One 'stage' event per stage as it settles ({stage, status, ms, result}),
+    then a final 'result' event with the full /analyze response, or an
+    'error' event if a required stage failed.
+    """
+    await verify_authorization(authorization)
+
+    text = clean_text(inp.text)
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_stage(name: str, result, status: dict):
+        queue.put_nowait(sse_event('stage', {'stage': name, **status, 'result': result}))
+
+    async def produce():
+        try:
+            results, status = await run_stages(build_stages(text), on_stage)
+            queue.put_nowait(sse_event('result', analysis_response(results, status)))
+        except StageError as e:
+            queue.put_nowait(sse_event('error', {
+                'stage': e.stage, 'detail': f'{e.stage.capitalize()} service error: {e.error}'
+            }))
+        except Exception as e:
+            queue.put_nowait(sse_event('error', {'detail': str(e)}))
+        finally:
+            queue.put_nowait(None)
+
+    async def events():
+        task = asyncio.create_task(produce())
+        try:
+            while (item := await queue.get()) is not None:
+                yield item
+        finally:
+            # Client went away: stop the remaining stages
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
+# Bulk ingestion: texts are grouped into chunks, sentiment, urgency and themes
+# go to the agents' batch endpoints (evidence and suggestion, which depend on
+# the themes, are still requested per text), and at most BATCH_MAX_INFLIGHT chunks are in
+# progress at once; finished lines wait in a bounded queue for the client.
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '32'))
+BATCH_MAX_INFLIGHT = int(os.getenv('BATCH_MAX_INFLIGHT', '4'))
+BATCH_STAGE_TIMEOUT = float(os.getenv('BATCH_STAGE_TIMEOUT', '300'))
+BATCH_STAGES = {
+    'sentiment': ('sentiment', '/analyze/batch'),
+    'urgency': ('urgency', '/detect/batch'),
+    'themes': ('nlp', '/themes/batch'),
+}
+ITEM_FIELDS = ('text', 'employee_email', 'employee_name', 'rating', 'timestamp')
+
+def _as_item(value) -> dict:
+    if isinstance(value, str):
+        return {'text': value}
+    if isinstance(value, dict):
+        return {k: value.get(k) for k in ITEM_FIELDS if value.get(k) not in (None, '')}
+    raise ValueError('each item must be a string or an object with a text field')
+
+def _parse_item(parse, value):
     try:
-        themes = await post_json(f'{NLP_URL}/themes', {'text': text})
-    except Exception as e:
-        raise HTTPException(502, f'NLP service error: {e}')
+        return _as_item(parse(value))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        return e
+
+def iter_batch_items(body: bytes, content_type: str | None):
+    """Yield items from a JSON list/object, NDJSON lines or a CSV with a text column.
+
+    A malformed line, row or list entry yields its ValueError in place of the
+    item, so one bad record only fails its own index; a body that cannot be
+    read at all (invalid JSON document, CSV without a text column) raises.
+    """
+    ctype = (content_type or '').split(';')[0].strip().lower()
+    text = body.decode('utf-8', errors='replace')
+    if ctype in ('application/x-ndjson', 'application/jsonl', 'application/ndjson'):
+        for line in text.splitlines():
+            if line.strip():
+                yield _parse_item(json.loads, line)
+    elif ctype == 'text/csv':
+        rows = csv.DictReader(io.StringIO(text))
+        if 'text' not in (rows.fieldnames or []):
+            raise ValueError('CSV upload needs a text column')
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # The reader resumes at the next line
+                yield ValueError(f'malformed CSV row: {e}')
+                continue
+            yield _parse_item(dict, row)
+    else:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('items', data.get('texts', []))
+        if not isinstance(data, list):
+            raise ValueError('expected a JSON list of texts or items')
+        for value in data:
+            yield _parse_item(lambda v: v, value)
+
+async def batch_stage(stage: str, texts: list[str]) -> list:
+    """One batch call for a stage, skipping texts already cached; returns result or exception per text"""
+    service, path = BATCH_STAGES[stage]
+    results: list = [None] * len(texts)
+    keys = [cache_key(stage, STAGE_VERSIONS[stage], t) for t in texts] if cache is not None else None
+    hits = await cache.aget_many(keys) if keys is not None else [None] * len(texts)
+    missing = []
+    for i, hit in enumerate(hits):
+        if hit is not None:
+            results[i] = hit
+        else:
+            missing.append(i)
+    if missing:
+        try:
+            resp = await asyncio.wait_for(
+                post_json(service, path, {'texts': [texts[i] for i in missing]}), BATCH_STAGE_TIMEOUT
+            )
+            for i, res in zip(missing, resp['results']):
+                results[i] = res
+                if keys is not None:
+                    cache_result(keys[i], res)
+        except Exception as e:
+            err = e if str(e) else RuntimeError(f'{stage} batch timed out')
+            for i in missing:
+                results[i] = err
+    return results
+
+def _submission(item: dict, text: str, results: dict) -> dict:
+    return {
+        'feedback': {
+            'text': text,
+            'employee_email': item.get('employee_email') or 'anonymous',
+            'employee_name': item.get('employee_name') or 'Anonymous',
+            'rating': int(item['rating']) if str(item.get('rating') or '').isdigit() else None,
+            'timestamp': item.get('timestamp'),
+        },
+        'analysis': {k: results.get(k) or {} for k in ('sentiment', 'urgency', 'themes', 'evidence', 'suggestion')},
+    }
+
+async def process_chunk(start: int, items: list, store: bool) -> list[dict]:
+    """Analyze one chunk; items are dicts or the ValueError for a malformed record"""
+    raw = ['' if isinstance(it, Exception) else it.get('text') or '' for it in items]
+    texts = sanitize_many('' if len(t) > TEXT_MAX_CHARS else t for t in raw)
+    valid = [i for i, t in enumerate(texts) if len(t) >= 3]
+    stage_names = list(BATCH_STAGES)
+    per_stage = await asyncio.gather(*(batch_stage(s, [texts[i] for i in valid]) for s in stage_names))
+    prefetched = {i: dict(zip(stage_names, res)) for i, *res in zip(valid, *per_stage)}
+
+    async def one(i: int) -> dict:
+        line = {'index': start + i}
+        if isinstance(items[i], Exception):
+            return {**line, 'ok': False, 'error': f'Invalid item: {items[i]}'}
+        if len(raw[i]) > TEXT_MAX_CHARS:
+            return {**line, 'ok': False, 'error': f'Text longer than {TEXT_MAX_CHARS} characters'}
+        if i not in prefetched:
+            return {**line, 'ok': False, 'error': 'Text too short'}
+        try:
+            results, status = await run_stages(build_stages(texts[i], prefetched[i]))
+        except StageError as e:
+            return {**line, 'ok': False, 'error': f'{e.stage.capitalize()} service error: {e.error}'}
+        line.update(ok=True, result=analysis_response(results, status))
+        if store:
+            try:
+                saved = await post_json('storage', '/submit', _submission(items[i], texts[i], results))
+                line['stored_id'] = saved.get('id')
+            except Exception as e:
+                line['store_error'] = str(e)
+        return line
 
+    return await asyncio.gather(*(one(i) for i in range(len(items))))
+
+@app.post('/analyze/batch')
+async def analyze_batch(request: Request, store: bool = False, authorization: str | None = Header(None)):
+    """Analyze many texts; streams one NDJSON line per item as chunks complete.
+
+    Body: JSON list (or {"items": [...]}) of strings/objects, an NDJSON stream
+    (application/x-ndjson) or CSV with a text column (text/csv). Items may carry
+    employee_email/employee_name/rating/timestamp, used when store=true writes
+    each result to feedback_storage. Lines are {"index", "ok", "result"|"error"}
+    in completion order, followed by a final {"done": true, ...} summary.
+    """
+    await verify_authorization(authorization)
+    # The body has to be read before the streaming response starts
+    body = await request.body()
+    content_type = request.headers.get('content-type')
+    out: asyncio.Queue = asyncio.Queue(maxsize=BATCH_CHUNK_SIZE * BATCH_MAX_INFLIGHT)
+    slots = asyncio.Semaphore(BATCH_MAX_INFLIGHT)
+    summary = {'done': True, 'total': 0, 'failed': 0}
+    tasks: list[asyncio.Task] = []
+
+    async def run_chunk(start: int, chunk: list[dict]):
+        try:
+            lines = await process_chunk(start, chunk, store)
+        except Exception as e:
+            lines = [{'index': start + i, 'ok': False, 'error': str(e)} for i in range(len(chunk))]
+        finally:
+            slots.release()
+        for line in lines:
+            await out.put(line)
+
+    async def produce():
+        chunk, start = [], 0
+        try:
+            for item in iter_batch_items(body, content_type):
+                chunk.append(item)
+                if len(chunk) == BATCH_CHUNK_SIZE:
+                    await slots.acquire()
+                    tasks.append(asyncio.create_task(run_chunk(start, chunk)))
+                    start, chunk = start + len(chunk), []
+        except Exception as e:
+            await out.put({'ok': False, 'error': f'Invalid batch input: {e}'})
+        # Items read before an unreadable remainder are still analyzed
+        if chunk:
+            await slots.acquire()
+            tasks.append(asyncio.create_task(run_chunk(start, chunk)))
+        await asyncio.gather(*tasks)
+        await out.put(None)
+
+    async def lines():
+        producer = asyncio.create_task(produce())
+        try:
+            while (line := await out.get()) is not None:
+                summary['total'] += 'index' in line
+                summary['failed'] += not line.get('ok')
+                yield json.dumps(line) + '\n'
+            yield json.dumps(summary) + '\n'
+        finally:
+            # Client gone (or done): stop reading input and drop in-flight chunks
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+# Asynchronous mode: /analyze/async stores the job in a SQLite queue and
+# returns at once; JOB_WORKERS tasks per process drain it and write results to
+# feedback_storage. Texts the keyword heuristic rates High go to the high lane,
+# which is always drained first. Processes may share one JOB_DB file. No
+# workers run by default; set JOB_WORKERS in the processes meant to drain it,
+# and JOB_EXTERNAL_WORKERS=1 in ones that only enqueue for such a process.
+# Without either, /analyze/async answers 503 instead of queueing jobs nobody runs.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '0'))
+JOB_EXTERNAL_WORKERS = os.getenv('JOB_EXTERNAL_WORKERS', '0').strip() == '1'
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1'))
+JOB_RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', str(7 * 86400)))
+_jobs: JobQueue | None = None
+_jobs_lock = threading.Lock()
+_job_workers: list[asyncio.Task] = []
+_jobs_signal = asyncio.Event()
+_jobs_pruned = 0.0
+
+def job_queue() -> JobQueue:
+    """The queue, opened (and JOB_DB created) on first use rather than at import"""
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            _jobs = JobQueue(
+                os.getenv('JOB_DB', 'jobs.db'),
+                max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '5')),
+                # Must outlast a whole pipeline run plus the storage write
+                lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', '300')),
+                retry_base=float(os.getenv('JOB_RETRY_BASE_SECONDS', '2')),
+                retry_max=float(os.getenv('JOB_RETRY_MAX_SECONDS', '300')),
+            )
+        return _jobs
+
+async def jobs_call(method: str, *args):
+    """Run a JobQueue method in a thread; sqlite3 calls block (up to its busy timeout)"""
+    return await asyncio.to_thread(lambda: getattr(job_queue(), method)(*args))
+
+def _notify_jobs():
+    """Wake idle workers now instead of at their next poll"""
+    global _jobs_signal
+    _jobs_signal.set()
+    _jobs_signal = asyncio.Event()
+
+class AsyncIn(In):
+    employee_email: str | None = None
+    employee_name: str | None = None
+    rating: int | None = None
+
+def _job_depth() -> dict:
+    if _jobs is None:
+        return {}
+    depth = _jobs.stats()['depth']
+    return {(status, lane): n for status, lanes in depth.items() for lane, n in lanes.items()}
+
+metrics.gauge('job_queue_jobs', 'Jobs in the async analysis queue by status and lane', ('status', 'lane'), fn=_job_depth)
+
+async def run_job(job: dict):
+    # The job id doubles as the trace id for every downstream call it makes
+    metrics.trace_id_var.set(job['id'])
+    payload = job['payload']
+    text = payload['text']
     try:
-        evidence = await post_json(f'{IR_URL}/search', {'query': themes.get('summary', text), 'k': 5})
+        results, status = await run_stages(build_stages(text))
+        saved = await post_json('storage', '/submit', _submission(payload.get('item') or {}, text, results))
+    except StageError as e:
+        error = f'{e.stage.capitalize()} service error: {e.error}'
     except Exception as e:
-        raise HTTPException(502, f'IR service error: {e}')
+        error = str(e) or type(e).__name__
+    else:
+        await jobs_call('complete', job['id'], {**analysis_response(results, status), 'stored_id': saved.get('id')})
+        return
+    retry = await jobs_call('fail', job['id'], error)
+    print(f"Orchestrator: job {job['id']} attempt {job['attempts']} failed ({'retrying' if retry else 'giving up'}): {error}")
+
+async def job_worker(n: int):
+    global _jobs_pruned
+    while True:
+        signal = _jobs_signal
+        try:
+            job = await jobs_call('claim')
+        except Exception as e:
+            print(f'Orchestrator: job queue unavailable: {e}')
+            job = None
+        if job is None:
+            if n == 0 and time.time() - _jobs_pruned > 3600:
+                _jobs_pruned = time.time()
+                try:
+                    await jobs_call('prune', JOB_RETENTION_SECONDS)
+                except Exception as e:
+                    print(f'Orchestrator: job prune failed: {e}')
+            try:
+                await asyncio.wait_for(signal.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await run_job(job)
+        except asyncio.CancelledError:
+            await jobs_call('release', job['id'])
+            raise
+
+@app.on_event('startup')
+async def start_job_workers():
+    for n in range(JOB_WORKERS):
+        _job_workers.append(asyncio.create_task(job_worker(n)))
 
+async def stop_job_workers():
+    for task in _job_workers:
+        task.cancel()
+    await asyncio.gather(*_job_workers, return_exceptions=True)
+    _job_workers.clear()
+    global _jobs
+    if _jobs is not None:
+        queue, _jobs = _jobs, None
+        await asyncio.to_thread(queue.close)
+
+def _job_view(job: dict) -> dict:
+    # The feedback text stays in the queue; it is not echoed back
+    return {k: v for k, v in job.items() if k != 'payload'}
+
+@app.post('/analyze/async', status_code=202)
+async def analyze_async(inp: AsyncIn, authorization: str | None = Header(None)):
+    """Queue the analysis and return a job id; poll /jobs/{id} for the result.
+
+    The finished job's result is the /analyze response plus stored_id, the
+    feedback_storage id the worker saved it under.
+    """
+    await verify_authorization(authorization)
+    if JOB_WORKERS <= 0 and not JOB_EXTERNAL_WORKERS:
+        raise HTTPException(503, 'Async analysis is off: no job workers drain the queue (set JOB_WORKERS)')
+
+    text = clean_text(inp.text)
+
+    lane = 'high' if heuristic_urgency(text)['urgency'] == 'High' else 'normal'
+    item = {k: v for k, v in inp.dict().items() if k != 'text' and v is not None}
     try:
-        suggestion = await post_json(
-            f'{SUGGESTION_URL}/suggest',
-            {'feedback': text, 'themes': themes.get('summary',''), 'entities': themes.get('entities', [])}
-        )
+        job_id = await jobs_call('enqueue', {'text': text, 'item': item}, lane)
     except Exception as e:
-        raise HTTPException(502, f'Suggestion service error: {e}')
+        raise HTTPException(503, f'Could not queue job: {e}')
+    _notify_jobs()
+    return {'job_id': job_id, 'status': 'queued', 'lane': lane, 'status_url': f'/jobs/{job_id}'}
+
+@app.get('/jobs')
+async def job_stats(authorization: str | None = Header(None)):
+    """Queue depth per status and lane, plus worker counters"""
+    await verify_authorization(authorization)
+    return {'workers': len(_job_workers), **(await jobs_call('stats'))}
 
-    return {'sentiment': sentiment, 'urgency': urgency, 'themes': themes, 'evidence': evidence, 'suggestion': suggestion}
+@app.get('/jobs/{job_id}')
+async def get_job(job_id: str, authorization: str | None = Header(None)):
+    await verify_authorization(authorization)
+    job = await jobs_call('get', job_id)
+    if job is None:
+        raise HTTPException(404, 'Job not found')
+    return _job_view(job)
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-import jwt, os, time
+import jwt, os, time, json, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives import serialization
+from shared.jwt_keys import key_id, load_hs_keys
 from fastapi.middleware.cors import CORSMiddleware
+from shared import metrics
 
 load_dotenv = lambda: None
 try:
@@ -15,15 +20,69 @@ except Exception:
 
 JWT_SECRET = os.getenv('JWT_SECRET', 'change_me_secret')
 ALGO = 'HS256'
+# Verification keys by kid. HS256 secrets come from JWT_SECRET / JWT_PREVIOUS_SECRETS;
+# setting JWT_PRIVATE_KEY_FILE (PEM) switches signing to RS256, and its public
+# key plus JWT_PREVIOUS_PUBLIC_KEY_FILES are published on /.well-known/jwks.json
+# so other services can verify tokens locally.
+HS_KEYS = load_hs_keys()
+SIGNING_KID = key_id(JWT_SECRET.encode())
+SIGNING_KEY = JWT_SECRET
+RS_KEYS = {}
+
+def _load_public_key(path: str):
+    with open(path, 'rb') as f:
+        return serialization.load_pem_public_key(f.read())
+
+def _public_kid(public_key) -> str:
+    return key_id(public_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+
+if os.getenv('JWT_PRIVATE_KEY_FILE'):
+    with open(os.getenv('JWT_PRIVATE_KEY_FILE'), 'rb') as f:
+        SIGNING_KEY = serialization.load_pem_private_key(f.read(), password=None)
+    ALGO = 'RS256'
+    SIGNING_KID = _public_kid(SIGNING_KEY.public_key())
+    RS_KEYS[SIGNING_KID] = SIGNING_KEY.public_key()
+    for path in filter(None, (p.strip() for p in os.getenv('JWT_PREVIOUS_PUBLIC_KEY_FILES', '').split(','))):
+        pub = _load_public_key(path)
+        RS_KEYS[_public_kid(pub)] = pub
+
+def decode_token(token: str) -> dict:
+    """Verify with the key named by the token's kid; kid-less tokens use the HS256 secrets"""
+    kid = jwt.get_unverified_header(token).get('kid')
+    if kid in RS_KEYS:
+        return jwt.decode(token, RS_KEYS[kid], algorithms=['RS256'])
+    if kid in HS_KEYS:
+        return jwt.decode(token, HS_KEYS[kid], algorithms=['HS256'])
+    if kid is None:
+        return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+    raise jwt.InvalidTokenError('Unknown signing key')
+
 FERNET_KEY = os.getenv('FERNET_KEY')
 if FERNET_KEY is None:
     FERNET_KEY = Fernet.generate_key().decode()
 try:
-    fernet = Fernet(FERNET_KEY.encode())
+    primary_fernet = Fernet(FERNET_KEY.encode())
 except Exception:
     # Fallback: supplied key was invalid; generate a valid one to avoid startup crash
     FERNET_KEY = Fernet.generate_key().decode()
-    fernet = Fernet(FERNET_KEY.encode())
+    primary_fernet = Fernet(FERNET_KEY.encode())
+
+# Key rotation: FERNET_KEY encrypts; FERNET_PREVIOUS_KEYS (comma separated)
+# can still decrypt, and /rotate re-encrypts their ciphertexts under FERNET_KEY.
+_previous_fernets = []
+for _key in filter(None, (k.strip() for k in os.getenv('FERNET_PREVIOUS_KEYS', '').split(','))):
+    try:
+        _previous_fernets.append(Fernet(_key.encode()))
+    except Exception:
+        print('Security Service: ignoring invalid key in FERNET_PREVIOUS_KEYS')
+fernet = MultiFernet([primary_fernet, *_previous_fernets])
+
+# Fernet work is CPU bound; it runs here instead of on the event loop
+CRYPTO_WORKERS = int(os.getenv('CRYPTO_WORKERS', str(min(8, os.cpu_count() or 1))))
+CRYPTO_CHUNK_SIZE = int(os.getenv('CRYPTO_CHUNK_SIZE', '256'))
+crypto_pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix='crypto')
 
 app = FastAPI(title='Security Service')
 app.add_middleware(
@@ -33,6 +92,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+metrics.instrument(app, 'security-service')
 
 auth_scheme = HTTPBearer()
 
@@ -61,7 +121,7 @@ def login(payload: LoginIn):
             'role': role,
             'name': user_info['name'],
             'exp': int(time.time()) + 3600
-        }, JWT_SECRET, algorithm=ALGO)
+        }, SIGNING_KEY, algorithm=ALGO, headers={'kid': SIGNING_KID})
         
         return {
             'access_token': token,
@@ -76,7 +136,7 @@ def login(payload: LoginIn):
 @app.get('/verify')
 def verify_token(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     try:
-        data = jwt.decode(creds.credentials, JWT_SECRET, algorithms=[ALGO])
+        data = decode_token(creds.credentials)
         return {
             'ok': True, 
             'sub': data['sub'],
@@ -89,7 +149,7 @@ def verify_token(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)):
 @app.get('/user-info')
 def get_user_info(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     try:
-        data = jwt.decode(creds.credentials, JWT_SECRET, algorithms=[ALGO])
+        data = decode_token(creds.credentials)
         return {
             'username': data['sub'],
             'role': data.get('role', 'employee'),
@@ -98,6 +158,16 @@ def get_user_info(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     except Exception as e:
         raise HTTPException(401, str(e))
 
+@app.get('/.well-known/jwks.json')
+def jwks():
+    """Public RS256 verification keys (HS256 secrets are never published)"""
+    keys = []
+    for kid, pub in RS_KEYS.items():
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(pub))
+        jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+        keys.append(jwk)
+    return {'keys': keys, 'signing_kid': SIGNING_KID, 'signing_alg': ALGO}
+
 @app.post('/encrypt')
 def encrypt_text(text: str):
     return {'cipher': fernet.encrypt(text.encode()).decode()}
@@ -105,3 +175,119 @@ def encrypt_text(text: str):
 @app.post('/decrypt')
 def decrypt_text(cipher: str):
     return {'plain': fernet.decrypt(cipher.encode()).decode()}
+
+class BatchIn(BaseModel):
+    items: list[str]
+
+CRYPTO_OPS = {
+    'encrypt': lambda s: fernet.encrypt(s.encode()).decode(),
+    'decrypt': lambda s: fernet.decrypt(s.encode()).decode(),
+    'rotate': lambda s: fernet.rotate(s.encode()).decode(),
+}
+
+def _apply_many(op: str, items: list[str]) -> tuple[list, list]:
+    fn = CRYPTO_OPS[op]
+    out, errors = [], []
+    for i, item in enumerate(items):
+        try:
+            out.append(fn(item))
+        except (InvalidToken, UnicodeError) as e:
+            # UnicodeError: text that is not valid UTF-8 either way (lone surrogates in, binary plaintext out)
+            out.append(None)
+            errors.append({'index': i, 'error': 'invalid token' if isinstance(e, InvalidToken) else str(e)})
+    return out, errors
+
+async def run_batch(op: str, items: list[str]) -> tuple[list, list]:
+    """Split items across the crypto pool and reassemble results in order"""
+    loop = asyncio.get_running_loop()
+    chunks = [items[i:i + CRYPTO_CHUNK_SIZE] for i in range(0, len(items), CRYPTO_CHUNK_SIZE)]
+    parts = await asyncio.gather(*(loop.run_in_executor(crypto_pool, _apply_many, op, c) for c in chunks))
+    out, errors = [], []
+    for n, (res, errs) in enumerate(parts):
+        errors.extend({**e, 'index': e['index'] + n * CRYPTO_CHUNK_SIZE} for e in errs)
+        out.extend(res)
+    return out, errors
+
+@app.post('/encrypt/batch')
+async def encrypt_batch(payload: BatchIn):
+    ciphers, errors = await run_batch('encrypt', payload.items)
+    return {'ciphers': ciphers, 'errors': errors}
+
+@app.post('/decrypt/batch')
+async def decrypt_batch(payload: BatchIn):
+    plains, errors = await run_batch('decrypt', payload.items)
+    return {'plains': plains, 'errors': errors}
+
+@app.post('/rotate')
+async def rotate_batch(payload: BatchIn):
+    """Re-encrypt ciphertexts (from any configured key) under the primary key"""
+    ciphers, errors = await run_batch('rotate', payload.items)
+    return {'ciphers': ciphers, 'errors': errors}
+
+def _transform_records(op: str, fields: list[str], lines: list[str]) -> str:
+    fn = CRYPTO_OPS[op]
+    out = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except (json.JSONDecodeError, RecursionError) as e:
+            # RecursionError: nesting too deep for the decoder
+            record = {'error': f'invalid JSON: {e}', 'record': line}
+        else:
+            if not isinstance(record, dict):
+                record = {'error': 'each line must be a JSON object', 'record': line}
+            else:
+                try:
+                    for field in fields:
+                        if isinstance(record.get(field), str):
+                            record[field] = fn(record[field])
+                except InvalidToken:
+                    record = {'error': 'invalid token', 'record': line}
+                except UnicodeError as e:
+                    # Lone surrogates in a field, or decrypted bytes that are not UTF-8
+                    record = {'error': str(e), 'record': line}
+        out.append(json.dumps(record, ensure_ascii=False))
+    return ''.join(f'{o}\n' for o in out)
+
+@app.post('/records/{op}')
+async def transform_records(op: str, request: Request, fields: str = 'text,employee_email,employee_name'):
+    """Field-level encrypt/decrypt/rotate over an NDJSON stream of records.
+
+    Each input line is a JSON object; the listed fields are transformed and the
+    record is written back as one NDJSON line, in order. Lines that fail come
+    back as {"error", "record"} instead of aborting the stream.
+    """
+    if op not in CRYPTO_OPS:
+        raise HTTPException(404, f'Unknown operation: {op}')
+    field_list = [f.strip() for f in fields.split(',') if f.strip()]
+    loop = asyncio.get_running_loop()
+
+    # Servers on ASGI spec >= 2.4 let us keep reading the upload while the
+    # response streams; older ones need the body read before responding.
+    spec = tuple(int(x) for x in request.scope.get('asgi', {}).get('spec_version', '2.0').split('.'))
+    body = None if spec >= (2, 4) else await request.body()
+
+    async def chunks():
+        if body is not None:
+            yield body
+        else:
+            async for chunk in request.stream():
+                yield chunk
+
+    async def lines():
+        buf, pending = b'', []
+        async for chunk in chunks():
+            buf += chunk
+            *complete, buf = buf.split(b'\n')
+            pending.extend(l.decode('utf-8', errors='replace') for l in complete)
+            if len(pending) >= CRYPTO_CHUNK_SIZE:
+                yield await loop.run_in_executor(crypto_pool, _transform_records, op, field_list, pending)
+                pending = []
+        if buf:
+            pending.append(buf.decode('utf-8', errors='replace'))
+        if pending:
+            yield await loop.run_in_executor(crypto_pool, _transform_records, op, field_list, pending)
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
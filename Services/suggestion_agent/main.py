@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
+from shared import metrics
 
 try:
     from openai import OpenAI
@@ -20,6 +21,7 @@ if OpenAI is not None and os.getenv('OPENAI_API_KEY'):
     client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 app = FastAPI(title='Suggestion Agent (OpenAI)')
+metrics.instrument(app, 'suggestion-agent')
 
 class Inp(BaseModel):
     feedback: str
@@ -37,7 +39,8 @@ async def suggest(inp: Inp):
             sugs.append('Consider reviewing compensation and communicate pay policy clearly.')
         if not sugs:
             sugs.append('Encourage better communication between managers and staff; collect more detail.')
-        return {'suggestions': sugs, 'rationale': 'Rule-based fallback'}
+        # degraded: callers should not cache this like an LLM answer
+        return {'suggestions': sugs, 'rationale': 'Rule-based fallback', 'degraded': True}
 
     if client is None:
         return rule_based()
@@ -47,7 +50,8 @@ async def suggest(inp: Inp):
     )
     user = f"Feedback:\n{inp.feedback}\n\nThemes:\n{inp.themes}\n\nEntities:\n{', '.join(inp.entities)}"
     try:
-        resp = client.chat.completions.create(model='gpt-4o-mini', messages=[{'role':'system','content':system},{'role':'user','content':user}], temperature=0.35)
+        with metrics.MODEL_SECONDS.time(model='openai-suggestion'):
+            resp = client.chat.completions.create(model='gpt-4o-mini', messages=[{'role':'system','content':system},{'role':'user','content':user}], temperature=0.35)
         text = resp.choices[0].message.content
         import json
         try:
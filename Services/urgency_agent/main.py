@@ -1,15 +1,12 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
 import os
+import asyncio
 from dotenv import load_dotenv
-import torch
-
-try:
-    from transformers import pipeline
-    from huggingface_hub import login
-except Exception:
-    pipeline = None
-    login = None
+from shared.urgency import heuristic_urgency
+from shared.nli import get_nli
+from shared.inference import InferenceExecutor
+from shared import metrics
 
 load_dotenv = lambda: None
 try:
@@ -19,107 +16,262 @@ except Exception:
     pass
 
 app = FastAPI(title='Urgency Agent (HF zero-shot + heuristic)')
+metrics.instrument(app, 'urgency-agent')
 
 class Inp(BaseModel):
     text: str
+    # Optional sentiment result for the same text ({'sentiment': label, 'score': p}),
+    # used as an extra cheap signal by the cascade
+    sentiment: dict | None = None
 
-def heuristic_urgency(txt: str) -> dict:
-    """Fallback urgency detection using keyword matching"""
-    t = (txt or '').lower().strip()
-    
-    # High urgency keywords
-    high_urgency = {
-        'urgent', 'emergency', 'critical', 'immediate', 'asap', 'crisis', 'serious',
-        'harassment', 'discrimination', 'bullying', 'threat', 'danger', 'unsafe',
-        'quit', 'leaving', 'resign', 'fire', 'terminate', 'sue', 'legal', 'lawyer',
-        'mental health', 'depression', 'anxiety', 'suicide', 'self-harm'
-    }
-    
-    # Medium urgency keywords
-    medium_urgency = {
-        'concern', 'worried', 'problem', 'issue', 'complaint', 'unhappy', 'frustrated',
-        'stress', 'overwhelmed', 'burnout', 'exhausted', 'tired', 'sick', 'illness',
-        'conflict', 'disagreement', 'argument', 'fight', 'tension', 'hostile'
-    }
-    
-    # Count urgency indicators
-    high_count = sum(1 for word in high_urgency if word in t)
-    medium_count = sum(1 for word in medium_urgency if word in t)
-    
-    if high_count > 0:
-        return {'urgency': 'High', 'confidence': min(0.9, 0.6 + (high_count * 0.1)), 'reason': f'Contains {high_count} high-urgency keywords'}
-    elif medium_count > 0:
-        return {'urgency': 'Medium', 'confidence': min(0.8, 0.5 + (medium_count * 0.1)), 'reason': f'Contains {medium_count} medium-urgency keywords'}
-    else:
-        return {'urgency': 'Low', 'confidence': 0.7, 'reason': 'No urgency indicators detected'}
+# Cascade: the keyword heuristic (plus the sentiment hint when given) answers
+# on its own when its confidence reaches CASCADE_THRESHOLD; only the rest pay
+# for a zero-shot pass. URGENCY_CASCADE=0 always runs the model.
+CASCADE_ENABLED = os.getenv('URGENCY_CASCADE', '1').strip() == '1'
+CASCADE_THRESHOLD = float(os.getenv('URGENCY_CASCADE_THRESHOLD', '0.8'))
+# Sentiment scores at or above this count as a confident hint
+SENTIMENT_HINT_MIN = float(os.getenv('URGENCY_SENTIMENT_HINT_MIN', '0.9'))
 
-# Initialize Hugging Face zero-shot classifier
+# Which tier answered each non-empty text
+tier_counts = {'heuristic': 0, 'model': 0, 'fallback': 0}
+metrics.counter(
+    'urgency_cascade_total', 'Texts answered per cascade tier', ('tier',),
+    fn=lambda: {(tier,): n for tier, n in tier_counts.items()}
+)
+
+def cheap_urgency(txt: str, sentiment: dict | None = None) -> dict:
+    """Keyword heuristic adjusted by a confident sentiment hint"""
+    res = heuristic_urgency(txt)
+    label = str((sentiment or {}).get('sentiment') or (sentiment or {}).get('label') or '').upper()
+    try:
+        score = float((sentiment or {}).get('score') or 0.0)
+    except (TypeError, ValueError):
+        score = 0.0
+    if score < SENTIMENT_HINT_MIN or label not in ('POSITIVE', 'NEGATIVE'):
+        return res
+    if label == 'POSITIVE' and res['urgency'] == 'Low':
+        # Clearly positive feedback without urgency terms is routine
+        res['confidence'] = max(res['confidence'], 0.85)
+        res['reason'] += '; strongly positive sentiment'
+    elif label == 'NEGATIVE' and res['urgency'] == 'High':
+        res['confidence'] = min(0.95, res['confidence'] + 0.1)
+        res['reason'] += '; strongly negative sentiment'
+    elif label == 'NEGATIVE' and res['urgency'] == 'Low':
+        # Upset without keywords: let the model decide
+        res['confidence'] = min(res['confidence'], 0.5)
+    return res
+
+def fallback_urgency(txt: str, sentiment: dict | None = None) -> dict:
+    """Heuristic answer standing in for the model (not loaded, refused, failed or unsure).
+
+    Marked degraded so callers do not cache it like a model answer.
+    """
+    tier_counts['fallback'] += 1
+    return {**cheap_urgency(txt, sentiment), 'tier': 'fallback', 'degraded': True}
+
+def cascade_hit(txt: str, sentiment: dict | None = None) -> dict | None:
+    """Cheap-tier answer when it is confident enough (or no model is loaded), else None"""
+    if zeroshot is None:
+        return fallback_urgency(txt, sentiment)
+    if CASCADE_ENABLED:
+        res = cheap_urgency(txt, sentiment)
+        if res['confidence'] >= CASCADE_THRESHOLD:
+            tier_counts['heuristic'] += 1
+            return {**res, 'tier': 'heuristic'}
+    return None
+
+# Zero-shot classifier: the shared NLI backend, in-process or the model server
+# at NLI_URL. Labels live in shared.nli; the winning one is mapped back to
+# High/Medium/Low.
 zeroshot = None
 try:
-    if pipeline is not None:
-        hf_token = (
-            os.getenv('HUGGINGFACE_TOKEN')
-            or os.getenv('HUGGINGFACEHUB_API_TOKEN')
-            or os.getenv('HF_TOKEN')
-        )
-        if hf_token and login is not None:
-            try:
-                os.environ['HUGGINGFACEHUB_API_TOKEN'] = hf_token
-                login(token=hf_token)
-            except Exception:
-                pass
-
-        # Use a robust zero-shot model for urgency classification
-        model_name = 'facebook/bart-large-mnli'
-        zeroshot = pipeline(
-            'zero-shot-classification',
-            model=model_name,
-            device=0 if torch.cuda.is_available() else -1
-        )
-        print('Urgency Agent: Hugging Face zero-shot model loaded successfully!')
+    zeroshot = get_nli()
+    if zeroshot is not None:
+        zeroshot.load()
+        print('Urgency Agent: zero-shot NLI backend ready')
 except Exception as e:
     print(f'Urgency Agent: failed to load HF model: {e}')
     zeroshot = None
 
+# Micro-batching: concurrent /detect calls are coalesced for up to
+# BATCH_WINDOW_MS (or BATCH_MAX_SIZE texts) into one model call.
+BATCH_MAX_SIZE = int(os.getenv('URGENCY_BATCH_MAX_SIZE', '16'))
+BATCH_WINDOW_MS = float(os.getenv('URGENCY_BATCH_WINDOW_MS', '10'))
+
+# Model calls leave the event loop for a bounded inference pool (sized by
+# INFERENCE_THREADS / INFERENCE_MAX_PENDING); a refused or failed call falls
+# back to the heuristic.
+inference = InferenceExecutor('urgency')
+
+def classify_texts(texts: list[str]) -> list[dict]:
+    """Run one batched zero-shot call (blocking) and return raw results in order"""
+    metrics.BATCH_SIZE.observe(len(texts), model='urgency')
+    with metrics.MODEL_SECONDS.time(model='urgency'):
+        return zeroshot.classify(texts, 'urgency')
+
+def to_urgency(text: str, res: dict) -> dict:
+    """Map a zero-shot result to our urgency levels"""
+    label = res['labels'][0]
+    score = float(res['scores'][0])
+
+    if 'High urgency' in label:
+        urgency_level = 'High'
+    elif 'Medium urgency' in label:
+        urgency_level = 'Medium'
+    else:
+        urgency_level = 'Low'
+
+    # Apply confidence threshold - if HF confidence is too low, use heuristic
+    if score < 0.6:
+        return fallback_urgency(text)
+
+    tier_counts['model'] += 1
+    reason = f'Hugging Face zero-shot classification (confidence: {score:.2f})'
+    return {'urgency': urgency_level, 'confidence': score, 'reason': reason, 'tier': 'model'}
+
+class MicroBatcher:
+    """Coalesces concurrent single-text requests into batched model calls"""
+
+    def __init__(self, fn, max_size: int, window_ms: float):
+        self.fn = fn
+        self.max_size = max(1, max_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def submit(self, text: str):
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await inference.run(self.fn, [t for t, _ in batch])
+                for (_, fut), res in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(res)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'pending': self.queue.qsize() if self.queue is not None else 0,
+        }
+
+batcher = MicroBatcher(classify_texts, BATCH_MAX_SIZE, BATCH_WINDOW_MS)
+
+@app.on_event('startup')
+async def start_batcher():
+    if zeroshot is not None:
+        batcher.start()
+
+@app.on_event('shutdown')
+async def stop_batcher():
+    await batcher.stop()
+
+class BatchInp(BaseModel):
+    texts: list[str]
+    # Optional per-text sentiment hints, aligned with texts
+    sentiments: list[dict | None] | None = None
+
 @app.post('/detect')
 async def detect_urgency(inp: Inp):
     text = (inp.text or '').strip()
     if not text:
         return {'urgency': 'Low', 'confidence': 1.0, 'reason': 'Empty input'}
 
-    # Try HF zero-shot first
-    if zeroshot is not None:
+    hit = cascade_hit(text, inp.sentiment)
+    if hit is not None:
+        return hit
+
+    # Cheap tier was not confident: HF zero-shot
+    try:
+        res = await batcher.submit(text)
+        return to_urgency(text, res)
+    except Exception as e:
+        print(f'Urgency Agent: inference error: {e}')
+
+    # Fallback to heuristic
+    return fallback_urgency(text)
+
+@app.post('/detect/batch')
+async def detect_urgency_batch(inp: BatchInp):
+    """Classify many texts with batched pipeline calls; results keep input order"""
+    texts = [(t or '').strip() for t in inp.texts]
+    hints = inp.sentiments or []
+    results: list[dict | None] = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        if not text:
+            results[i] = {'urgency': 'Low', 'confidence': 1.0, 'reason': 'Empty input'}
+            continue
+        results[i] = cascade_hit(text, hints[i] if i < len(hints) else None)
+        if results[i] is None:
+            pending.append(i)
+
+    for start in range(0, len(pending), BATCH_MAX_SIZE):
+        chunk = pending[start:start + BATCH_MAX_SIZE]
         try:
-            # Define urgency levels with descriptive labels
-            labels = [
-                'High urgency - requires immediate HR attention',
-                'Medium urgency - needs prompt follow-up',
-                'Low urgency - routine feedback'
-            ]
-            hypothesis_template = 'This feedback indicates {}.'
-            
-            res = zeroshot(text, candidate_labels=labels, hypothesis_template=hypothesis_template)
-            
-            # Map HF results to our urgency levels
-            label = res['labels'][0]
-            score = float(res['scores'][0])
-            
-            if 'High urgency' in label:
-                urgency_level = 'High'
-            elif 'Medium urgency' in label:
-                urgency_level = 'Medium'
-            else:
-                urgency_level = 'Low'
-            
-            # Apply confidence threshold - if HF confidence is too low, use heuristic
-            if score < 0.6:
-                return heuristic_urgency(text)
-            
-            reason = f'Hugging Face zero-shot classification (confidence: {score:.2f})'
-            return {'urgency': urgency_level, 'confidence': score, 'reason': reason}
-            
+            raw = await inference.run(classify_texts, [texts[i] for i in chunk])
+            for i, res in zip(chunk, raw):
+                results[i] = to_urgency(texts[i], res)
         except Exception as e:
-            print(f'Urgency Agent: inference error: {e}')
+            print(f'Urgency Agent: batch inference error: {e}')
+            for i in chunk:
+                results[i] = fallback_urgency(texts[i])
 
-    # Fallback to heuristic
-    return heuristic_urgency(text)
+    return {'results': results, 'count': len(results)}
+
+def cascade_stats() -> dict:
+    total = sum(tier_counts.values())
+    return {
+        'enabled': CASCADE_ENABLED,
+        'threshold': CASCADE_THRESHOLD,
+        'tiers': dict(tier_counts),
+        'heuristic_rate': round(tier_counts['heuristic'] / total, 3) if total else 0.0,
+    }
+
+@app.get('/health')
+async def health_check():
+    """Health check endpoint"""
+    return {
+        'status': 'healthy',
+        'service': 'urgency-agent',
+        'model_loaded': zeroshot is not None,
+        'nli': zeroshot.stats() if zeroshot is not None else None,
+        'batcher': batcher.stats(),
+        'inference': inference.stats(),
+        'cascade': cascade_stats(),
+    }
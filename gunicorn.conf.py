@@ -0,0 +1,49 @@
+# Multi-worker serving for the model agents, e.g.
+#   WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py Services.urgency_agent.main:app -b 127.0.0.1:8007
+# The app (and its models) is imported once in the master before forking, so
+# workers share the weights copy-on-write instead of loading one copy each.
+import gc
+import os
+import shutil
+import tempfile
+
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Each agent's inference pool and torch threads size themselves from this
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Metrics live in each worker; they write snapshots here so /metrics, served
+# by whichever worker gets the scrape, reports the whole service. One fresh
+# directory per master unless METRICS_MULTIPROC_DIR names one.
+_metrics_tmp = None
+if workers > 1 and not os.getenv('METRICS_MULTIPROC_DIR'):
+    _metrics_tmp = tempfile.mkdtemp(prefix='feedback-metrics-')
+    os.environ['METRICS_MULTIPROC_DIR'] = _metrics_tmp
+# ONNX Runtime sessions start their thread pools when created, and those do
+# not survive fork, so the ONNX backend loads per worker instead
+preload_app = os.getenv(
+    'GUNICORN_PRELOAD', '0' if os.getenv('INFERENCE_BACKEND', 'torch').strip().lower() == 'onnx' else '1'
+).strip() == '1'
+if preload_app:
+    # Read by the agents at import: load models now, in the master
+    os.environ.setdefault('MODEL_PRELOAD_BEFORE_FORK', '1')
+# Model loading and long batches can keep a worker busy for a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so its
+    # passes in the workers do not write to (and un-share) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Thread pools do not survive fork; re-apply torch's thread limits here
+    from shared.inference import configure_torch
+    configure_torch()
+
+
+def on_exit(server):
+    if _metrics_tmp:
+        shutil.rmtree(_metrics_tmp, ignore_errors=True)
@@ -1,21 +1,83 @@
-from fastapi import FastAPI
-from transformers import pipeline
+import os
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from shared.models import hf_device
+from shared.onnx_backend import load_pipeline
+from shared.inference import InferenceExecutor, InferenceBusy
+from shared import metrics
 
 # Initialize FastAPI app
 app = FastAPI(title="Sentiment Detector Agent")
+metrics.instrument(app, "sentiment-agent")
 
-# Load HuggingFace sentiment model
-sentiment_model = pipeline("sentiment-analysis")
+# Load HuggingFace sentiment model (the pipeline's default checkpoint, named so
+# INFERENCE_BACKEND=onnx can export and quantize it)
+SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", "distilbert-base-uncased-finetuned-sst-2-english")
+sentiment_model = load_pipeline("sentiment-analysis", SENTIMENT_MODEL, device=hf_device())
+
+# The pipeline call blocks, so it runs on the inference pool, off the event loop
+inference = InferenceExecutor("sentiment")
+
+class Inp(BaseModel):
+    text: str
+
+class BatchInp(BaseModel):
+    texts: list[str]
+
+def predict(text: str):
+    with metrics.MODEL_SECONDS.time(model="sentiment"):
+        return sentiment_model(text)
+
+def predict_many(texts: list[str]):
+    metrics.BATCH_SIZE.observe(len(texts), model="sentiment")
+    with metrics.MODEL_SECONDS.time(model="sentiment"):
+        return sentiment_model(texts)
+
+def to_result(text: str, result: dict) -> dict:
+    return {
+        "feedback": text,
+        "sentiment": result['label'],
+        "score": float(result['score'])
+    }
+
+async def classify(text: str) -> dict:
+    try:
+        result = (await inference.run(predict, text))[0]
+    except InferenceBusy as e:
+        raise HTTPException(503, str(e))
+    return to_result(text, result)
 
 @app.get("/")
 def home():
     return {"message": "Sentiment Detector Agent is running"}
 
+@app.post("/analyze")
+async def analyze(inp: Inp):
+    """Sentiment for {"text": ...}, as sent by the orchestrator"""
+    return await classify(inp.text)
+
+@app.post("/analyze/batch")
+async def analyze_batch(inp: BatchInp):
+    """Sentiment for {"texts": [...]} in one pipeline call; results keep input order"""
+    if not inp.texts:
+        return {"results": [], "count": 0}
+    try:
+        raw = await inference.run(predict_many, inp.texts)
+    except InferenceBusy as e:
+        raise HTTPException(503, str(e))
+    results = [to_result(t, r) for t, r in zip(inp.texts, raw)]
+    return {"results": results, "count": len(results)}
+
 @app.post("/analyze/")
-def analyze_feedback(feedback: str):
-    result = sentiment_model(feedback)[0]
+async def analyze_feedback(feedback: str):
+    # Original query-parameter form, kept for existing callers
+    return await classify(feedback)
+
+@app.get("/health")
+async def health_check():
     return {
-        "feedback": feedback,
-        "sentiment": result['label'],
-        "score": float(result['score'])
+        "status": "healthy",
+        "service": "sentiment-agent",
+        "model": SENTIMENT_MODEL,
+        "inference": inference.stats(),
     }
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Disk writes queued for the writer thread beyond this are dropped (memory still has them)
+DISK_QUEUE_MAX = 10000
+DISK_WRITE_BATCH = 500
+
+
+def cache_key(namespace: str, version: str, *parts) -> str:
+    """Content address for a cached result: stage, its model/config version and its inputs."""
+    h = hashlib.sha256()
+    for part in (namespace, version, *parts):
+        data = part if isinstance(part, str) else json.dumps(part, sort_keys=True, ensure_ascii=False)
+        h.update(data.encode('utf-8'))
+        h.update(b'\x00')
+    return f'{namespace}:{h.hexdigest()}'
+
+
+class ResultCache:
+    """Two-tier result cache: in-process LRU plus an optional SQLite file.
+
+    Entries expire after ttl seconds; both tiers are bounded by entry count
+    and evict least recently used (memory) or oldest (disk) first. Hit/miss
+    counters are kept per namespace so each pipeline stage can be tracked.
+
+    Nothing touches SQLite on the caller's thread from async code: aget /
+    aget_many read the disk tier in a worker thread, and set hands disk
+    writes to a background thread that commits them in batches.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400, disk_path: str | None = None,
+                 disk_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self._mem: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Guards the SQLite connection, shared by the writer and reader threads
+        self._disk_lock = threading.Lock()
+        self._disk = None
+        self._disk_writes = 0
+        self._disk_queue: queue.Queue | None = None
+        self._writer: threading.Thread | None = None
+        self.disk_dropped = 0
+        self.metrics: dict[str, dict[str, int]] = {}
+        if disk_path:
+            try:
+                self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+                self._disk.execute('PRAGMA journal_mode=WAL')
+                self._disk.execute('PRAGMA synchronous=NORMAL')
+                self._disk.execute(
+                    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL)'
+                )
+                self._disk.execute('CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires)')
+            except Exception as e:
+                print(f'ResultCache: disk tier disabled ({e})')
+                self._disk = None
+            else:
+                self._disk_queue = queue.Queue(maxsize=DISK_QUEUE_MAX)
+                self._writer = threading.Thread(target=self._write_loop, name='result-cache-writer', daemon=True)
+                self._writer.start()
+
+    def _count(self, key: str, outcome: str):
+        ns = key.split(':', 1)[0]
+        m = self.metrics.setdefault(ns, {'hits': 0, 'disk_hits': 0, 'misses': 0})
+        m[outcome] += 1
+
+    def _get_mem(self, key: str, now: float):
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._mem.move_to_end(key)
+                    self._count(key, 'hits')
+                    return entry[1]
+                del self._mem[key]
+        return None
+
+    def _get_disk(self, keys: list[str], now: float) -> dict:
+        """Unexpired disk entries for keys, as {key: (expires, value)}"""
+        found = {}
+        with self._disk_lock:
+            if self._disk is None:
+                return found
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._disk.execute(
+                    f"SELECT key, expires, value FROM cache WHERE key IN ({', '.join('?' * len(part))})", part
+                ).fetchall()
+                for key, expires, value in rows:
+                    if expires > now:
+                        found[key] = (expires, json.loads(value))
+        return found
+
+    def _fill(self, keys: list[str], found: dict) -> list:
+        out = []
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    expires, value = found[key]
+                    self._put_mem(key, expires, value)
+                    self._count(key, 'disk_hits')
+                    out.append(value)
+                else:
+                    self._count(key, 'misses')
+                    out.append(None)
+        return out
+
+    def get(self, key: str):
+        """Blocking lookup; async callers use aget"""
+        now = time.time()
+        value = self._get_mem(key, now)
+        if value is not None:
+            return value
+        found = self._get_disk([key], now) if self._disk is not None else {}
+        return self._fill([key], found)[0]
+
+    async def aget(self, key: str):
+        return (await self.aget_many([key]))[0]
+
+    async def aget_many(self, keys: list[str]) -> list:
+        """Cached value (or None) per key; memory misses are read from disk in a worker thread"""
+        now = time.time()
+        out = [self._get_mem(key, now) for key in keys]
+        missing = [key for key, value in zip(keys, out) if value is None]
+        if not missing:
+            return out
+        found = await asyncio.to_thread(self._get_disk, missing, now) if self._disk is not None else {}
+        filled = iter(self._fill(missing, found))
+        return [next(filled) if value is None else value for value in out]
+
+    def _put_mem(self, key: str, expires: float, value):
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def set(self, key: str, value, ttl: float | None = None):
+        """Store in memory now; the disk copy is written by the writer thread"""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put_mem(key, expires, value)
+        if self._disk_queue is None:
+            return
+        try:
+            self._disk_queue.put_nowait((key, expires, json.dumps(value, ensure_ascii=False)))
+        except queue.Full:
+            self.disk_dropped += 1
+
+    def _write_loop(self):
+        # Everything queued so far goes in one transaction, so a burst of
+        # stage results costs one commit instead of one per result
+        while True:
+            item = self._disk_queue.get()
+            if item is None:
+                return
+            rows = [item]
+            stop = False
+            while len(rows) < DISK_WRITE_BATCH:
+                try:
+                    item = self._disk_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                rows.append(item)
+            self._write_rows(rows)
+            if stop:
+                return
+
+    def _write_rows(self, rows: list):
+        with self._disk_lock:
+            if self._disk is None:
+                return
+            try:
+                self._disk.execute('BEGIN')
+                self._disk.executemany('INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)', rows)
+                before = self._disk_writes
+                self._disk_writes += len(rows)
+                # Trim periodically rather than on every write
+                if self._disk_writes // 1000 != before // 1000:
+                    self._trim_disk()
+                self._disk.execute('COMMIT')
+            except Exception as e:
+                if self._disk.in_transaction:
+                    self._disk.execute('ROLLBACK')
+                print(f'ResultCache: disk write failed ({e})')
+
+    def _trim_disk(self):
+        self._disk.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        excess = self._disk.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.disk_max_entries
+        if excess > 0:
+            self._disk.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)', (excess,)
+            )
+
+    def stats(self) -> dict:
+        out = {'entries': len(self._mem), 'disk': self._disk is not None, 'stages': {}}
+        if self._disk_queue is not None:
+            out['disk_pending'] = self._disk_queue.qsize()
+            out['disk_dropped'] = self.disk_dropped
+        for ns, m in self.metrics.items():
+            total = m['hits'] + m['disk_hits'] + m['misses']
+            out['stages'][ns] = {**m, 'hit_rate': round((m['hits'] + m['disk_hits']) / total, 3) if total else 0.0}
+        return out
+
+    def close(self):
+        """Write out queued entries, then close the disk tier"""
+        if self._writer is not None:
+            self._disk_queue.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._disk_lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
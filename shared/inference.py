@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import metrics
+
+# Model calls run on a small per-process thread pool so the event loop (and
+# /health) stays responsive while a forward pass is in progress.
+INFERENCE_THREADS = max(1, int(os.getenv('INFERENCE_THREADS', '1')))
+# Calls queued or running beyond this are refused with InferenceBusy
+INFERENCE_MAX_PENDING = int(os.getenv('INFERENCE_MAX_PENDING', '64'))
+# Server processes per service; gunicorn reads the same variable
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+# torch threads per inference thread. By default the cores are split between
+# worker processes and their inference threads so they do not oversubscribe.
+TORCH_INTRA_OP_THREADS = int(os.getenv('TORCH_INTRA_OP_THREADS', '0')) or max(
+    1, (os.cpu_count() or 1) // (WEB_CONCURRENCY * INFERENCE_THREADS)
+)
+TORCH_INTER_OP_THREADS = int(os.getenv('TORCH_INTER_OP_THREADS', '1'))
+# Set by gunicorn.conf.py: load models while importing the app, in the master,
+# so forked workers share the weights copy-on-write
+PRELOAD_BEFORE_FORK = os.getenv('MODEL_PRELOAD_BEFORE_FORK', '0').strip() == '1'
+
+SAMPLE_WINDOW = 1024
+
+WAIT_SECONDS = metrics.histogram(
+    'inference_queue_wait_seconds', 'Time a model call waited for a free inference thread', ('pool',)
+)
+COMPUTE_SECONDS = metrics.histogram(
+    'inference_compute_seconds', 'Time a model call ran on an inference thread', ('pool',)
+)
+
+
+class InferenceBusy(Exception):
+    """More than max_pending model calls are already waiting or running"""
+
+
+def configure_torch():
+    """Apply the torch thread settings to this process; safe to call again after fork"""
+    try:
+        import torch
+    except Exception:
+        return
+    torch.set_num_threads(TORCH_INTRA_OP_THREADS)
+    try:
+        torch.set_num_interop_threads(TORCH_INTER_OP_THREADS)
+    except RuntimeError:
+        # Only settable before the first inter-op parallel work in the process
+        pass
+
+
+def _summary(samples) -> dict:
+    if not samples:
+        return {'avg': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    return {
+        'avg': round(sum(ordered) / len(ordered), 2),
+        'p50': round(ordered[len(ordered) // 2], 2),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        'max': round(ordered[-1], 2),
+    }
+
+
+_executors = weakref.WeakSet()
+
+
+class InferenceExecutor:
+    """Bounded thread pool for blocking model calls with queue-wait / compute timings.
+
+    queue_wait_ms is the time a call spent waiting for a free inference
+    thread, compute_ms the time the model call itself took; the first
+    growing while the second stays flat means the service needs more
+    capacity, not a faster model.
+    """
+
+    def __init__(self, name: str, threads: int = INFERENCE_THREADS, max_pending: int = INFERENCE_MAX_PENDING):
+        self.name = name
+        self.threads = max(1, threads)
+        self.max_pending = max_pending
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.calls = 0
+        self.rejected = 0
+        self.errors = 0
+        self._wait_ms = deque(maxlen=SAMPLE_WINDOW)
+        self._compute_ms = deque(maxlen=SAMPLE_WINDOW)
+        _executors.add(self)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f'{self.name}-inference')
+            return self._pool
+
+    def _reset(self):
+        # Threads do not survive fork; the child starts with a fresh pool
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+
+    async def run(self, fn, *args):
+        if self.max_pending > 0 and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise InferenceBusy(f'{self.name}: {self.pending} model calls pending')
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            self._wait_ms.append((started - submitted) * 1000)
+            WAIT_SECONDS.observe(started - submitted, pool=self.name)
+            self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                self.running -= 1
+                elapsed = time.perf_counter() - started
+                self._compute_ms.append(elapsed * 1000)
+                COMPUTE_SECONDS.observe(elapsed, pool=self.name)
+
+        self.pending += 1
+        self.calls += 1
+        # Run with the caller's context so the trace id reaches nested HTTP calls
+        ctx = contextvars.copy_context()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), ctx.run, call)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            'threads': self.threads,
+            'torch_threads': TORCH_INTRA_OP_THREADS,
+            'waiting': self.pending - self.running,
+            'running': self.running,
+            'max_pending': self.max_pending,
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'queue_wait_ms': _summary(list(self._wait_ms)),
+            'compute_ms': _summary(list(self._compute_ms)),
+        }
+
+
+def _after_fork_in_child():
+    for executor in list(_executors):
+        executor._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+configure_torch()
@@ -0,0 +1,209 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Lanes are drained strictly in this order; within a lane, oldest first
+LANES = {'high': 0, 'normal': 1}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    lane TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, priority, available_at, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at);
+'''
+
+
+def _iso(ts: float | None) -> str | None:
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+class JobQueue:
+    """Durable FIFO job queue with priority lanes in a SQLite file.
+
+    Jobs go queued -> running -> done | failed. A claimed job holds a lease;
+    if its worker dies the job becomes claimable again once the lease runs
+    out, so several processes can share one file. Failed attempts are
+    retried with exponential backoff (plus jitter) up to max_attempts.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5, lease_seconds: float = 300,
+                 retry_base: float = 2.0, retry_max: float = 300.0):
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.metrics = {'enqueued': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'released': 0}
+
+    def _write(self, fn):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                out = fn(self._conn)
+                self._conn.execute('COMMIT')
+                return out
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def enqueue(self, payload: dict, lane: str = 'normal', max_attempts: int | None = None) -> str:
+        if lane not in LANES:
+            raise ValueError(f'unknown lane: {lane}')
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write(lambda c: c.execute(
+            'INSERT INTO jobs (id, lane, priority, status, payload, max_attempts, available_at, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, lane, LANES[lane], 'queued', json.dumps(payload, ensure_ascii=False),
+             max_attempts or self.max_attempts, now, now)
+        ))
+        self.metrics['enqueued'] += 1
+        return job_id
+
+    def claim(self) -> dict | None:
+        """Lease the next runnable job (highest lane, oldest first), or None"""
+        def take(c):
+            now = time.time()
+            # Expired leases whose worker used the last attempt are not retried again
+            c.execute(
+                "UPDATE jobs SET status = 'failed', error = 'worker lost', finished_at = ?, lease_until = NULL "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = c.execute(
+                "SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_until < ?) "
+                'ORDER BY priority, available_at, created_at LIMIT 1',
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            c.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                'started_at = COALESCE(started_at, ?) WHERE id = ?',
+                (now + self.lease_seconds, now, row['id'])
+            )
+            return c.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+        row = self._write(take)
+        return self._to_dict(row) if row is not None else None
+
+    def complete(self, job_id: str, result: dict):
+        self._write(lambda c: c.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, finished_at = ? "
+            'WHERE id = ?',
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+        ))
+        self.metrics['completed'] += 1
+
+    def fail(self, job_id: str, error: str) -> bool:
+        """Record a failed attempt; returns True if the job will be retried"""
+        def record(c):
+            row = c.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            now = time.time()
+            if row is None:
+                return False
+            if row['attempts'] >= row['max_attempts']:
+                c.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, finished_at = ? WHERE id = ?",
+                    (error, now, job_id)
+                )
+                return False
+            delay = min(self.retry_max, self.retry_base * 2 ** (row['attempts'] - 1))
+            c.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, lease_until = NULL, available_at = ? WHERE id = ?",
+                (error, now + delay * random.uniform(0.5, 1.0), job_id)
+            )
+            return True
+        retry = self._write(record)
+        self.metrics['retried' if retry else 'failed'] += 1
+        return retry
+
+    def release(self, job_id: str):
+        """Put a running job back without counting the attempt (e.g. on shutdown)"""
+        self._write(lambda c: c.execute(
+            "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_until = NULL, "
+            "available_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        ))
+        self.metrics['released'] += 1
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def prune(self, older_than: float) -> int:
+        """Delete finished jobs older than older_than seconds"""
+        cutoff = time.time() - older_than
+        return self._write(lambda c: c.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+        ).rowcount)
+
+    def stats(self) -> dict:
+        """Queue depth per status and lane, oldest waiting job, and this process's counters"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, lane, COUNT(*) AS n, MIN(created_at) AS oldest, SUM(attempts > 0) AS retrying '
+                'FROM jobs GROUP BY status, lane'
+            ).fetchall()
+        depth = {s: {lane: 0 for lane in LANES} for s in ('queued', 'running', 'done', 'failed')}
+        oldest = {}
+        retrying = 0
+        for r in rows:
+            depth.setdefault(r['status'], {})[r['lane']] = r['n']
+            if r['status'] == 'queued':
+                oldest[r['lane']] = round(now - r['oldest'], 1)
+                retrying += r['retrying'] or 0
+        return {
+            'depth': depth,
+            'queued': sum(depth['queued'].values()),
+            'retrying': retrying,
+            'oldest_queued_seconds': oldest,
+            **self.metrics,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        return {
+            'id': row['id'],
+            'lane': row['lane'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'payload': json.loads(row['payload']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': _iso(row['created_at']),
+            'started_at': _iso(row['started_at']),
+            'finished_at': _iso(row['finished_at']),
+            'next_attempt_at': _iso(row['available_at']) if row['status'] == 'queued' else None,
+        }
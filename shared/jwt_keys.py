@@ -0,0 +1,17 @@
+import hashlib
+import os
+
+
+def key_id(material: bytes) -> str:
+    """Stable kid for a signing key: short hash of the secret / public key bytes."""
+    return hashlib.sha256(material).hexdigest()[:16]
+
+
+def load_hs_keys() -> dict[str, str]:
+    """HS256 secrets by kid: JWT_SECRET first, then JWT_PREVIOUS_SECRETS (comma separated).
+
+    Previous secrets stay valid for verification so tokens survive a rotation.
+    """
+    secrets = [os.getenv('JWT_SECRET', 'change_me_secret')]
+    secrets += [s.strip() for s in os.getenv('JWT_PREVIOUS_SECRETS', '').split(',') if s.strip()]
+    return {key_id(s.encode()): s for s in secrets}
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import threading
+import time
+
+
+def _normalize(groups: dict) -> dict[str, dict[str, float]]:
+    """Accept {group: [terms]} or {group: {term: weight}}; terms are lowercased."""
+    out = {}
+    for group, terms in groups.items():
+        if isinstance(terms, dict):
+            out[group] = {str(t).lower(): float(w) for t, w in terms.items()}
+        else:
+            out[group] = {str(t).lower(): 1.0 for t in terms}
+    return out
+
+
+class KeywordMatcher:
+    """All keyword groups compiled into one word-bounded regex, scored in a single pass.
+
+    Word boundaries keep 'fire' from matching 'firewall' and 'sue' from
+    matching 'issue'; multi-word terms tolerate any run of whitespace.
+    """
+
+    def __init__(self, groups: dict):
+        self.groups = _normalize(groups)
+        self._lookup: dict[str, tuple[str, float]] = {}
+        for group, terms in self.groups.items():
+            for term, weight in terms.items():
+                self._lookup.setdefault(term, (group, weight))
+        # Longest first so 'mental health' wins over a shorter overlapping term
+        alternation = '|'.join(
+            re.escape(t).replace(r'\ ', r'\s+') for t in sorted(self._lookup, key=len, reverse=True)
+        )
+        self._regex = re.compile(rf'\b(?:{alternation})\b', re.IGNORECASE) if alternation else None
+
+    def scan(self, text: str) -> dict[str, dict]:
+        """Per group: summed weight of distinct matched terms and the terms themselves."""
+        hits: dict[str, dict] = {}
+        if not text or self._regex is None:
+            return hits
+        seen = set()
+        for m in self._regex.finditer(text):
+            term = ' '.join(m.group(0).lower().split())
+            if term in seen:
+                continue
+            seen.add(term)
+            group, weight = self._lookup[term]
+            h = hits.setdefault(group, {'score': 0.0, 'terms': []})
+            h['score'] += weight
+            h['terms'].append(term)
+        return hits
+
+
+class KeywordConfig:
+    """KeywordMatcher backed by an optional JSON file that is reloaded when it changes.
+
+    The file maps group names to term lists or {term: weight} objects; without
+    a file (or if it fails to parse) the built-in defaults are used.
+    """
+
+    def __init__(self, path: str | None, defaults: dict, check_interval: float = 5.0):
+        self.path = path
+        self.defaults = defaults
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._matcher = KeywordMatcher(defaults)
+        self._reload()
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._matcher = KeywordMatcher(json.load(f))
+            print(f'Keywords: loaded {self.path}')
+        except Exception as e:
+            print(f'Keywords: failed to load {self.path}, keeping previous terms: {e}')
+        self._mtime = mtime
+
+    @property
+    def matcher(self) -> KeywordMatcher:
+        now = time.monotonic()
+        if self.path and now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._reload()
+        return self._matcher
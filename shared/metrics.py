@@ -0,0 +1,386 @@
+import atexit
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Prometheus text exposition (format 0.0.4) for every service, plus a trace id
+# carried in X-Trace-Id from the orchestrator through each downstream call.
+# Kept dependency-free: a few counters/histograms do not need prometheus_client.
+TRACE_HEADER = 'X-Trace-Id'
+# One line per request (and per orchestrator stage) with the trace id
+METRICS_LOG = os.getenv('METRICS_LOG', '1').strip() == '1'
+# Each process keeps its own registry. With several workers (gunicorn) set
+# this to a directory private to the service: every worker writes a snapshot
+# there every METRICS_FLUSH_SECONDS and /metrics serves the sum over all of
+# them, gauges per pid. gunicorn.conf.py sets it when it forks workers.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '').strip()
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Accepted incoming ids; anything else is replaced so it cannot break headers or log lines
+TRACE_ID_RE = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+trace_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar('trace_id', default=None)
+
+
+def current_trace_id() -> str | None:
+    return trace_id_var.get()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def log(event: str, **fields):
+    """One key=value line tagged with the current trace id"""
+    if not METRICS_LOG:
+        return
+    parts = ' '.join(f'{k}={v}' for k, v in fields.items())
+    print(f'trace={current_trace_id() or "-"} {event} {parts}'.rstrip())
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # fn() -> {label values tuple: value}, read at scrape time from stats a service already keeps
+        self.fn = fn
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def _state(self) -> dict:
+        if self.fn is not None:
+            return dict(self.fn())
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self):
+        return [(self.name, self.labelnames, k, v, '') for k, v in self._state().items()]
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, names, values, value, extra in self._samples():
+            lines.append(f'{name}{_labels(names, values, extra)} {_num(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _state(self) -> dict:
+        with self._lock:
+            return {k: [list(s[0]), s[1], s[2]] for k, s in self._values.items()}
+
+    def _samples(self):
+        out = []
+        for key, (counts, total, count) in self._state().items():
+            for bound, n in zip(self.buckets, counts):
+                out.append((f'{self.name}_bucket', self.labelnames, key, n, f'le="{_num(bound)}"'))
+            out.append((f'{self.name}_sum', self.labelnames, key, total, ''))
+            out.append((f'{self.name}_count', self.labelnames, key, count, ''))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        # Same name returns the same metric, so modules can declare what they use
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if METRICS_MULTIPROC_DIR:
+            self.flush()
+            metrics = self._merged()
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} unavailable: {e}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """This process's values, as written to METRICS_MULTIPROC_DIR"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        out = {}
+        for metric in metrics:
+            try:
+                state = metric._state()
+            except Exception:
+                continue
+            out[metric.name] = {
+                'kind': metric.kind,
+                'help': metric.help,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(metric.buckets[:-1]) if isinstance(metric, Histogram) else None,
+                'values': [[[str(v) for v in key], value] for key, value in state.items()],
+            }
+        return out
+
+    def flush(self):
+        path = os.path.join(METRICS_MULTIPROC_DIR, f'{_service}.{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f'metrics: snapshot write failed: {e}')
+
+    def _merged(self) -> list[_Metric]:
+        """Every worker's snapshot of this service combined: counters and
+        histograms summed (including exited workers), live gauges labelled by pid"""
+        merged: dict[str, _Metric] = {}
+        prefix = f'{_service}.'
+        for entry in sorted(os.listdir(METRICS_MULTIPROC_DIR)):
+            pid = entry[len(prefix):-len('.json')]
+            if not entry.startswith(prefix) or not entry.endswith('.json') or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(METRICS_MULTIPROC_DIR, entry), encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _alive(int(pid))
+            for name, spec in snapshot.items():
+                kind = spec['kind']
+                if kind == 'gauge' and not alive:
+                    continue
+                metric = merged.get(name)
+                if metric is None:
+                    if kind == 'histogram':
+                        metric = Histogram(name, spec['help'], spec['labelnames'], spec['buckets'])
+                    elif kind == 'gauge':
+                        metric = Gauge(name, spec['help'], spec['labelnames'] + ['pid'])
+                    else:
+                        metric = Counter(name, spec['help'], spec['labelnames'])
+                    merged[name] = metric
+                for key, value in spec['values']:
+                    key = tuple(key)
+                    if kind == 'gauge':
+                        metric._values[key + (pid,)] = value
+                    elif kind == 'histogram':
+                        state = metric._values.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+                    else:
+                        metric._values[key] = metric._values.get(key, 0) + value
+        return list(merged.values())
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+REGISTRY = Registry()
+_service = 'app'
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        REGISTRY.flush()
+
+
+def _start_flusher():
+    """Periodic snapshots from this process; threads do not survive fork, so once per pid"""
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+    atexit.register(REGISTRY.flush)
+
+
+def counter(name: str, help: str, labelnames=(), fn=None) -> Counter:
+    return REGISTRY._get(Counter, name, help, labelnames, fn)
+
+
+def gauge(name: str, help: str, labelnames=(), fn=None) -> Gauge:
+    return REGISTRY._get(Gauge, name, help, labelnames, fn)
+
+
+def histogram(name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY._get(Histogram, name, help, labelnames, buckets)
+
+
+# Shared by every service; the service label tells them apart when scraped together
+REQUEST_SECONDS = histogram(
+    'http_request_duration_seconds', 'HTTP request latency (until the response body is sent)',
+    ('service', 'method', 'route', 'status')
+)
+MODEL_SECONDS = histogram('model_inference_seconds', 'Time spent in a model call', ('model',))
+BATCH_SIZE = histogram('model_batch_size', 'Texts per model call', ('model',), buckets=SIZE_BUCKETS)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: trace id in/out, request latency histogram and one log line per request"""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if METRICS_MULTIPROC_DIR and _flusher_pid != os.getpid():
+            _start_flusher()
+        incoming = dict(scope.get('headers') or []).get(TRACE_HEADER.lower().encode())
+        trace_id = incoming.decode('latin-1') if incoming else ''
+        if not TRACE_ID_RE.fullmatch(trace_id):
+            trace_id = new_trace_id()
+        token = trace_id_var.set(trace_id)
+        status = {'code': 500}
+
+        async def send_with_trace(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                message['headers'] = list(message.get('headers') or []) + [
+                    (TRACE_HEADER.lower().encode(), trace_id.encode('latin-1'))
+                ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            if route != '/metrics':
+                REQUEST_SECONDS.observe(
+                    elapsed, service=self.service, method=scope['method'], route=route, status=status['code']
+                )
+                log('request', service=self.service, method=scope['method'], route=route,
+                    status=status['code'], ms=round(elapsed * 1000, 1))
+            trace_id_var.reset(token)
+
+
+def instrument(app, service: str):
+    """Mount the middleware and GET /metrics on a FastAPI app"""
+    from fastapi.responses import PlainTextResponse
+
+    global _service
+    _service = service
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    @app.get('/metrics', include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+def trace_headers() -> dict:
+    trace_id = current_trace_id()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+async def _inject_trace(request):
+    trace_id = current_trace_id()
+    if trace_id and TRACE_HEADER not in request.headers:
+        request.headers[TRACE_HEADER] = trace_id
+
+
+def _inject_trace_sync(request):
+    trace_id = current_trace_id()
+    if trace_id and TRACE_HEADER not in request.headers:
+        request.headers[TRACE_HEADER] = trace_id
+
+
+def httpx_hooks(sync: bool = False) -> dict:
+    """event_hooks for an httpx client that forward the current trace id"""
+    return {'request': [_inject_trace_sync if sync else _inject_trace]}
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+_login_lock = threading.Lock()
+_logged_in = False
+
+
+def hf_login():
+    """Log in to the Hugging Face hub once per process if a token is configured."""
+    global _logged_in
+    with _login_lock:
+        if _logged_in:
+            return
+        _logged_in = True
+        hf_token = (
+            os.getenv('HUGGINGFACE_TOKEN')
+            or os.getenv('HUGGINGFACEHUB_API_TOKEN')
+            or os.getenv('HF_TOKEN')
+        )
+        if not hf_token:
+            return
+        try:
+            from huggingface_hub import login
+            os.environ['HUGGINGFACEHUB_API_TOKEN'] = hf_token
+            login(token=hf_token)
+        except Exception:
+            pass
+
+
+def hf_device() -> int:
+    """Pipeline device index: first GPU when available, else CPU."""
+    try:
+        import torch
+        return 0 if torch.cuda.is_available() else -1
+    except Exception:
+        return -1
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except Exception:
+            return None
+
+
+def _param_bytes(obj):
+    """Size of the weights for torch-backed pipelines, None for anything else."""
+    model = getattr(obj, 'model', None)
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """Loads each registered model once per process and shares it across requests.
+
+    Loaders run lazily on first get() (or eagerly via preload()) under a lock,
+    so concurrent first requests wait for one load instead of each building
+    their own copy. A loader that fails is recorded and returns None until
+    reload() is called, letting callers take their existing fallbacks.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmups = {}
+        self._models = {}
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader, warmup=None):
+        self._loaders[name] = loader
+        if warmup is not None:
+            self._warmups[name] = warmup
+
+    def get(self, name: str):
+        if name in self._models:
+            return self._models[name]
+        with self._lock:
+            if name not in self._models:
+                self._load(name)
+        return self._models[name]
+
+    def _load(self, name: str):
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        try:
+            model = self._loaders[name]()
+            error = None
+        except Exception as e:
+            model = None
+            error = str(e)
+            print(f'ModelRegistry: failed to load {name}: {e}')
+        rss_after = _rss_bytes()
+        self._models[name] = model
+        self._info[name] = {
+            'loaded': model is not None,
+            'load_seconds': round(time.perf_counter() - started, 3),
+            'param_bytes': _param_bytes(model),
+            'rss_delta_bytes': (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+            'error': error,
+            'warm': False,
+        }
+
+    def reload(self, name: str):
+        with self._lock:
+            self._models.pop(name, None)
+            self._load(name)
+        return self._models[name]
+
+    def preload(self, names=None):
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def warmup(self, names=None):
+        """Run each loaded model once so lazy kernels/allocations happen before real traffic."""
+        for name in names or list(self._warmups):
+            model = self.get(name)
+            if model is None or name not in self._warmups:
+                continue
+            started = time.perf_counter()
+            try:
+                self._warmups[name](model)
+                self._info[name]['warm'] = True
+                self._info[name]['warmup_seconds'] = round(time.perf_counter() - started, 3)
+            except Exception as e:
+                print(f'ModelRegistry: warm-up failed for {name}: {e}')
+
+    def stats(self) -> dict:
+        return {
+            name: dict(self._info.get(name, {'loaded': False, 'warm': False}))
+            for name in self._loaders
+        }
@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared.models import hf_login, hf_device
+from shared.onnx_backend import load_onnx
+from shared import metrics
+
+try:
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+except Exception:
+    torch = None
+    AutoTokenizer = None
+    AutoModelForSequenceClassification = None
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+# One NLI model serves every zero-shot label set (urgency, themes). NLI_URL
+# points the agents at a shared model server instead of loading it in-process.
+NLI_MODEL = os.getenv('NLI_MODEL') or os.getenv('NLP_CLASSIFIER_MODEL') or 'facebook/bart-large-mnli'
+NLI_URL = os.getenv('NLI_URL', '').strip()
+# (premise, hypothesis) pairs per forward pass
+NLI_BATCH_SIZE = int(os.getenv('NLI_BATCH_SIZE', '32'))
+# Per-text, per-label-set results are kept briefly so a repeated request for
+# the same feedback item (e.g. a retried batch) does not run the model again
+NLI_CACHE_SIZE = int(os.getenv('NLI_CACHE_SIZE', '4096'))
+NLI_CACHE_TTL = float(os.getenv('NLI_CACHE_TTL', '300'))
+NLI_TIMEOUT = float(os.getenv('NLI_TIMEOUT', '60'))
+
+URGENCY_LABELS = [
+    'High urgency - requires immediate HR attention',
+    'Medium urgency - needs prompt follow-up',
+    'Low urgency - routine feedback'
+]
+URGENCY_TEMPLATE = 'This feedback indicates {}.'
+THEME_TEMPLATE = 'This feedback is about {}.'
+
+
+class SharedNLI:
+    """Zero-shot classification for several label sets with one model.
+
+    Label sets are registered by name (the first classify() call for a set
+    registers it too); their hypotheses are tokenized once. A request only
+    pairs its texts with the hypotheses of the set it asked for, and results
+    are cached per (set, text). Scores are the softmax of the entailment
+    logits over the set's labels, as in the zero-shot pipeline.
+    """
+
+    def __init__(self, model_name: str = NLI_MODEL, batch_size: int = NLI_BATCH_SIZE,
+                 cache_size: int = NLI_CACHE_SIZE, cache_ttl: float = NLI_CACHE_TTL):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.tokenizer = None
+        self.model = None
+        self.device = None
+        self.backend = None
+        self.entailment_id = None
+        self.label_sets: dict[str, tuple[tuple[str, ...], str]] = {}
+        self._hypotheses: dict[str, list[list[int]]] = {}
+        self._cache: OrderedDict[tuple[str, str], tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.forward_passes = 0
+        self.pairs = 0
+        self.texts = 0
+        self.hits = 0
+        metrics.counter(
+            'nli_cache_lookups_total', 'Per-text, per-label-set NLI result cache lookups', ('outcome',),
+            fn=lambda: {('hit',): self.hits, ('miss',): self.texts}
+        )
+
+    def load(self):
+        if self.model is not None:
+            return self
+        if AutoModelForSequenceClassification is None:
+            raise RuntimeError('transformers/torch are not installed')
+        with self._load_lock:
+            if self.model is not None:
+                return self
+            hf_login()
+            device = hf_device()
+            onnx = load_onnx(
+                'zero-shot-classification', self.model_name, device,
+                parity_kwargs={'candidate_labels': URGENCY_LABELS, 'hypothesis_template': URGENCY_TEMPLATE}
+            )
+            if onnx is not None:
+                # ONNX Runtime model: takes and returns torch tensors, CPU only
+                model, tokenizer = onnx
+                self.device = torch.device('cpu')
+                self.backend = 'onnx'
+            else:
+                tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                self.device = torch.device(f'cuda:{device}' if device >= 0 else 'cpu')
+                model.to(self.device).eval()
+                self.backend = 'torch'
+            label2id = {k.lower(): v for k, v in model.config.label2id.items()}
+            self.entailment_id = next((v for k, v in label2id.items() if k.startswith('entail')), -1)
+            self.tokenizer = tokenizer
+            self.model = model
+            for name, (labels, template) in self.label_sets.items():
+                self._hypotheses[name] = self._encode_hypotheses(labels, template)
+            print(f'SharedNLI: loaded {self.model_name} on {self.device} ({self.backend})')
+        return self
+
+    def _encode_hypotheses(self, labels, template) -> list[list[int]]:
+        return [
+            self.tokenizer(template.format(label), add_special_tokens=False)['input_ids']
+            for label in labels
+        ]
+
+    def register(self, name: str, labels: list[str], template: str):
+        spec = (tuple(labels), template)
+        with self._lock:
+            if self.label_sets.get(name) == spec:
+                return
+            self.label_sets[name] = spec
+            if self.tokenizer is not None:
+                self._hypotheses[name] = self._encode_hypotheses(*spec)
+            # Cached entries for this set were scored against its previous labels
+            for key in [k for k in self._cache if k[0] == name]:
+                del self._cache[key]
+
+    def classify(self, texts: list[str], name: str, labels: list[str] | None = None,
+                 template: str | None = None) -> list[dict]:
+        """{'labels', 'scores'} per text for label set name, best label first"""
+        if labels is not None:
+            self.register(name, labels, template or THEME_TEMPLATE)
+        if name not in self.label_sets:
+            raise KeyError(f'unknown label set: {name}')
+        self.load()
+        return self.score(texts, name)
+
+    def score(self, texts: list[str], name: str) -> list[dict]:
+        """Results for label set name per text, from the cache or one batched pass"""
+        out: list[dict | None] = [None] * len(texts)
+        owned, waiting = {}, {}
+        now = time.time()
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = (name, text)
+                entry = self._cache.get(key)
+                if entry is not None and entry[0] > now:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    out[i] = entry[1]
+                elif key in self._inflight:
+                    # Another request is scoring this text right now; wait for it
+                    waiting.setdefault(text, (self._inflight[key], []))[1].append(i)
+                elif text in owned:
+                    owned[text].append(i)
+                else:
+                    owned[text] = [i]
+                    self._inflight[key] = threading.Event()
+        if owned:
+            try:
+                results = self._forward(list(owned), name)
+                with self._lock:
+                    for text, res in zip(owned, results):
+                        self._cache[(name, text)] = (time.time() + self.cache_ttl, res)
+                        self._cache.move_to_end((name, text))
+                        for i in owned[text]:
+                            out[i] = res
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            finally:
+                with self._lock:
+                    done = [self._inflight.pop((name, t)) for t in owned]
+                for event in done:
+                    event.set()
+        for text, (event, idx) in waiting.items():
+            event.wait(NLI_TIMEOUT)
+            with self._lock:
+                entry = self._cache.get((name, text))
+            res = entry[1] if entry is not None else self._forward([text], name)[0]
+            for i in idx:
+                out[i] = res
+        return out
+
+    def _forward(self, texts: list[str], name: str) -> list[dict]:
+        tok = self.tokenizer
+        with self._lock:
+            labels = self.label_sets[name][0]
+            hyps = self._hypotheses[name]
+        if not labels:
+            return [{'labels': [], 'scores': []} for _ in texts]
+        max_len = min(getattr(tok, 'model_max_length', 1024) or 1024, 1024)
+        pairs = []
+        for text in texts:
+            # Premise tokenized once and reused for every hypothesis
+            premise = tok(text, add_special_tokens=False)['input_ids']
+            for hyp in hyps:
+                room = max_len - len(hyp) - tok.num_special_tokens_to_add(pair=True)
+                pairs.append(tok.build_inputs_with_special_tokens(premise[:max(room, 1)], hyp))
+
+        entail = []
+        metrics.BATCH_SIZE.observe(len(texts), model='nli')
+        with self._model_lock, torch.inference_mode(), metrics.MODEL_SECONDS.time(model='nli'):
+            for start in range(0, len(pairs), self.batch_size):
+                batch = tok.pad({'input_ids': pairs[start:start + self.batch_size]}, return_tensors='pt')
+                logits = self.model(**{k: v.to(self.device) for k, v in batch.items()}).logits
+                entail.extend(logits[:, self.entailment_id].float().cpu().tolist())
+                self.forward_passes += 1
+        self.pairs += len(pairs)
+        self.texts += len(texts)
+
+        results = []
+        for pos in range(0, len(entail), len(labels)):
+            scores = torch.softmax(torch.tensor(entail[pos:pos + len(labels)]), dim=0).tolist()
+            ranked = sorted(zip(labels, scores), key=lambda ls: ls[1], reverse=True)
+            results.append({'labels': [l for l, _ in ranked], 'scores': [float(s) for _, s in ranked]})
+        return results
+
+    def stats(self) -> dict:
+        return {
+            'mode': 'local',
+            'model': self.model_name,
+            'loaded': self.model is not None,
+            'backend': self.backend,
+            'label_sets': {name: len(labels) for name, (labels, _) in self.label_sets.items()},
+            'texts': self.texts,
+            'pairs': self.pairs,
+            'forward_passes': self.forward_passes,
+            'cache_hits': self.hits,
+            'cache_entries': len(self._cache),
+        }
+
+
+class NLIClient:
+    """Same interface as SharedNLI, backed by the NLI model server at NLI_URL"""
+
+    def __init__(self, url: str, timeout: float = NLI_TIMEOUT):
+        if httpx is None:
+            raise RuntimeError('httpx is required for NLI_URL')
+        self.url = url.rstrip('/')
+        self.model_name = NLI_MODEL
+        self.label_sets: dict[str, tuple[tuple[str, ...], str]] = {}
+        self._client = httpx.Client(base_url=self.url, timeout=timeout, event_hooks=metrics.httpx_hooks(sync=True))
+        self.calls = 0
+
+    def load(self):
+        return self
+
+    def register(self, name: str, labels: list[str], template: str):
+        self.label_sets[name] = (tuple(labels), template)
+
+    def classify(self, texts: list[str], name: str, labels: list[str] | None = None,
+                 template: str | None = None) -> list[dict]:
+        if labels is not None:
+            self.register(name, labels, template or THEME_TEMPLATE)
+        labels, template = self.label_sets[name]
+        resp = self._client.post('/classify', json={
+            'texts': texts, 'label_set': name, 'labels': list(labels), 'template': template
+        })
+        resp.raise_for_status()
+        self.calls += 1
+        data = resp.json()
+        self.model_name = data.get('model', self.model_name)
+        return data['results']
+
+    def stats(self) -> dict:
+        return {'mode': 'remote', 'url': self.url, 'model': self.model_name, 'calls': self.calls}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_nli():
+    """Process-wide NLI backend: NLIClient when NLI_URL is set, else the in-process model.
+
+    Returns None when neither is available (no NLI_URL and no transformers).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            if NLI_URL:
+                _shared = NLIClient(NLI_URL)
+            elif AutoModelForSequenceClassification is not None:
+                _shared = SharedNLI()
+            if _shared is not None:
+                _shared.register('urgency', URGENCY_LABELS, URGENCY_TEMPLATE)
+        return _shared
@@ -0,0 +1,225 @@
+import os
+import re
+import shutil
+import threading
+
+try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+except Exception:
+    ort = None
+    ORTModelForSequenceClassification = None
+    ORTModelForSeq2SeqLM = None
+    ORTQuantizer = None
+    AutoQuantizationConfig = None
+
+try:
+    from transformers import AutoTokenizer, pipeline
+except Exception:
+    AutoTokenizer = None
+    pipeline = None
+
+# torch (default) keeps the stock transformers pipelines; onnx exports each
+# model once to ONNX_CACHE_DIR, optionally int8-quantizes it, and runs it with
+# ONNX Runtime on CPU. Falls back to torch when onnxruntime/optimum are missing.
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch').strip().lower()
+ONNX_CACHE_DIR = os.path.expanduser(os.getenv('ONNX_CACHE_DIR', '~/.cache/feedback-onnx'))
+# Dynamic (weights-only) int8 quantization; activations are quantized at run time
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', '1').strip() == '1'
+# Instruction set the quantized kernels target: avx2, avx512, avx512_vnni or arm64
+ONNX_QUANT_ARCH = os.getenv('ONNX_QUANT_ARCH', 'avx2').strip().lower()
+# 0 lets ONNX Runtime pick (one thread per physical core)
+ORT_INTRA_OP_THREADS = int(os.getenv('ORT_INTRA_OP_THREADS', '0'))
+ORT_INTER_OP_THREADS = int(os.getenv('ORT_INTER_OP_THREADS', '1'))
+# Compare the ONNX model against the torch pipeline at load time and keep
+# torch if they disagree; needs both models in memory while it runs.
+ONNX_PARITY_CHECK = os.getenv('ONNX_PARITY_CHECK', '0').strip() == '1'
+ONNX_PARITY_MIN_AGREEMENT = float(os.getenv('ONNX_PARITY_MIN_AGREEMENT', '0.95'))
+ONNX_PARITY_MAX_SCORE_DIFF = float(os.getenv('ONNX_PARITY_MAX_SCORE_DIFF', '0.05'))
+# Generated text drifts token by token under int8, so summaries are compared by word overlap
+ONNX_PARITY_MIN_SUMMARY_OVERLAP = float(os.getenv('ONNX_PARITY_MIN_SUMMARY_OVERLAP', '0.6'))
+
+PARITY_TEXTS = [
+    'My manager keeps changing priorities and I am close to burning out.',
+    'The new benefits package is great and the team feels appreciated.',
+    'I have been harassed by a colleague and need help urgently.',
+    'Meetings run long but overall communication has improved this quarter.',
+    'Pay has not kept up with the workload since the reorganisation.',
+    'Thanks for the flexible hours, they make a real difference.',
+]
+
+_CLASSIFICATION_TASKS = {'sentiment-analysis', 'text-classification', 'zero-shot-classification'}
+_export_lock = threading.Lock()
+
+
+def use_onnx() -> bool:
+    return INFERENCE_BACKEND == 'onnx' and ort is not None
+
+
+def session_options():
+    so = ort.SessionOptions()
+    if ORT_INTRA_OP_THREADS > 0:
+        so.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    if ORT_INTER_OP_THREADS > 0:
+        so.inter_op_num_threads = ORT_INTER_OP_THREADS
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return so
+
+
+def _model_class(task: str):
+    if task in _CLASSIFICATION_TASKS:
+        return ORTModelForSequenceClassification
+    if task in ('summarization', 'text2text-generation'):
+        return ORTModelForSeq2SeqLM
+    raise ValueError(f'no ONNX model class for task {task!r}')
+
+
+def _model_dir(model_name: str, variant: str) -> str:
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '--', model_name)
+    return os.path.join(ONNX_CACHE_DIR, slug, variant)
+
+
+def export(model_name: str, task: str, quantize: bool = ONNX_QUANTIZE) -> str:
+    """Export (and quantize) model_name once; returns the directory to load from"""
+    cls = _model_class(task)
+    fp32_dir = _model_dir(model_name, 'fp32')
+    target = _model_dir(model_name, f'int8-{ONNX_QUANT_ARCH}') if quantize else fp32_dir
+    with _export_lock:
+        if os.path.exists(os.path.join(target, 'config.json')):
+            return target
+        if not os.path.exists(os.path.join(fp32_dir, 'config.json')):
+            print(f'ONNX: exporting {model_name} to {fp32_dir}')
+            tmp = f'{fp32_dir}.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            cls.from_pretrained(model_name, export=True).save_pretrained(tmp)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp)
+            os.replace(tmp, fp32_dir)
+        if not quantize:
+            return fp32_dir
+        print(f'ONNX: quantizing {model_name} (dynamic int8, {ONNX_QUANT_ARCH})')
+        qconfig = getattr(AutoQuantizationConfig, ONNX_QUANT_ARCH)(is_static=False, per_channel=False)
+        tmp = f'{target}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        for fname in sorted(os.listdir(fp32_dir)):
+            if fname.endswith('.onnx'):
+                ORTQuantizer.from_pretrained(fp32_dir, file_name=fname).quantize(
+                    save_dir=tmp, quantization_config=qconfig
+                )
+        AutoTokenizer.from_pretrained(fp32_dir).save_pretrained(tmp)
+        os.replace(tmp, target)
+        return target
+
+
+def load_model(model_name: str, task: str):
+    """ONNX Runtime model for task, exported/quantized on first use"""
+    path = export(model_name, task)
+    files = set(os.listdir(path))
+
+    def pick(stem: str):
+        for name in (f'{stem}_quantized.onnx', f'{stem}.onnx'):
+            if name in files:
+                return name
+        return None
+
+    kwargs = {'session_options': session_options(), 'provider': 'CPUExecutionProvider'}
+    if _model_class(task) is ORTModelForSeq2SeqLM:
+        kwargs['encoder_file_name'] = pick('encoder_model')
+        kwargs['decoder_file_name'] = pick('decoder_model')
+        with_past = pick('decoder_with_past_model')
+        if with_past:
+            kwargs['decoder_with_past_file_name'] = with_past
+        else:
+            kwargs['use_cache'] = False
+    else:
+        kwargs['file_name'] = pick('model')
+    return _model_class(task).from_pretrained(path, **kwargs), AutoTokenizer.from_pretrained(path)
+
+
+def check_parity(task: str, reference, candidate, texts: list[str] = PARITY_TEXTS, **call_kwargs) -> dict:
+    """Compare two pipelines for task on texts.
+
+    Classification: share of texts with the same top label and the largest
+    top-score difference. Summarization: mean word-set overlap (Jaccard).
+    """
+    ref = reference(texts, **call_kwargs)
+    cand = candidate(texts, **call_kwargs)
+    agree, max_diff = 0, 0.0
+    for r, c in zip(ref, cand):
+        r = r[0] if isinstance(r, list) else r
+        c = c[0] if isinstance(c, list) else c
+        if 'summary_text' in r:
+            a, b = set(r['summary_text'].lower().split()), set(c['summary_text'].lower().split())
+            agree += len(a & b) / len(a | b) if a | b else 1.0
+            continue
+        r_label = r['labels'][0] if 'labels' in r else r['label']
+        c_label = c['labels'][0] if 'labels' in c else c['label']
+        r_score = r['scores'][0] if 'scores' in r else r['score']
+        c_score = c['scores'][0] if 'scores' in c else c['score']
+        agree += r_label == c_label
+        max_diff = max(max_diff, abs(float(r_score) - float(c_score)))
+    agreement = agree / len(texts) if texts else 1.0
+    if task == 'summarization':
+        passed = agreement >= ONNX_PARITY_MIN_SUMMARY_OVERLAP
+    else:
+        passed = agreement >= ONNX_PARITY_MIN_AGREEMENT and max_diff <= ONNX_PARITY_MAX_SCORE_DIFF
+    return {'task': task, 'texts': len(texts), 'agreement': round(agreement, 3),
+            'max_score_diff': round(max_diff, 4), 'passed': passed}
+
+
+def load_onnx(task: str, model_name: str, device: int = -1, parity_kwargs: dict | None = None):
+    """(model, tokenizer) on ONNX Runtime, or None to stay on torch.
+
+    None when the backend is torch, a GPU device is given, export/load fails,
+    or ONNX_PARITY_CHECK=1 and the ONNX model disagrees with the torch pipeline.
+    """
+    if not use_onnx() or device >= 0:
+        return None
+    try:
+        model, tokenizer = load_model(model_name, task)
+        if ONNX_PARITY_CHECK:
+            report = check_parity(
+                task,
+                pipeline(task, model=model_name, device=device),
+                pipeline(task, model=model, tokenizer=tokenizer),
+                **(parity_kwargs or {})
+            )
+            print(f'ONNX: parity for {model_name}: {report}')
+            if not report['passed']:
+                return None
+        print(f'ONNX: serving {model_name} ({task}) with ONNX Runtime')
+        return model, tokenizer
+    except Exception as e:
+        print(f'ONNX: falling back to torch for {model_name}: {e}')
+        return None
+
+
+def load_pipeline(task: str, model_name: str, device: int = -1, parity_kwargs: dict | None = None):
+    """transformers pipeline for task on the configured backend; outputs are the same either way"""
+    onnx = load_onnx(task, model_name, device, parity_kwargs)
+    if onnx is not None:
+        return pipeline(task, model=onnx[0], tokenizer=onnx[1])
+    return pipeline(task, model=model_name, device=device)
+
+
+if __name__ == '__main__':
+    # Pre-export and check a model: python -m shared.onnx_backend <task> <model> [candidate labels...]
+    import sys
+    import time
+
+    if ort is None:
+        sys.exit('onnxruntime and optimum are required')
+    task, model_name, labels = sys.argv[1], sys.argv[2], sys.argv[3:]
+    kwargs = {'candidate_labels': labels} if task == 'zero-shot-classification' else {}
+    if task == 'summarization':
+        kwargs = {'max_length': 40, 'min_length': 8, 'do_sample': False}
+    model, tokenizer = load_model(model_name, task)
+    candidate = pipeline(task, model=model, tokenizer=tokenizer)
+    reference = pipeline(task, model=model_name, device=-1)
+    print(check_parity(task, reference, candidate, **kwargs))
+    for name, pipe in (('torch', reference), ('onnx', candidate)):
+        pipe(PARITY_TEXTS[:1], **kwargs)
+        started = time.perf_counter()
+        pipe(PARITY_TEXTS, **kwargs)
+        print(f'{name}: {(time.perf_counter() - started) / len(PARITY_TEXTS) * 1000:.1f} ms/text')
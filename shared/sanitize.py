@@ -1,14 +1,351 @@
 import re
+from bisect import bisect_left
+from typing import Iterable, Iterator
 
-SCRIPT_TAG = re.compile(r"<\\s*script[^>]*>(.*?)<\\s*/\\s*script>", re.IGNORECASE | re.DOTALL)
-JS_URL = re.compile(r"javascript:\\S+", re.IGNORECASE)
-SQL_INJECTION = re.compile(r"(;|--)|(/\\*)|(\\*/)|\\x00|\\x1a")
+# Every rule deletes its match: whole <script> elements, javascript: URLs and
+# SQL comment/terminator tokens plus NUL / SUB control characters. SANITIZE_RE
+# is the full rule set as one alternation; the leading lookahead lets the
+# scanner skip characters no rule can start with.
+SANITIZE_RE = re.compile(
+    r"(?=[<j;\-/*\x00\x1a])(?:"
+    r"<\s*script[^>]*>.*?<\s*/\s*script\s*>"
+    r"|javascript:\S+"
+    r"|;|--|/\*|\*/|\x00|\x1a)",
+    re.IGNORECASE | re.DOTALL,
+)
+# The lazy ".*?" up to a closing tag rescans the rest of the text for every
+# unterminated opener, so with many of those SANITIZE_RE is applied by hand:
+# the element is reduced to its "<script" start and completed by _Elements.
+TOKEN_RE = re.compile(
+    r"(?=[<j;\-/*\x00\x1a])(?:(<\s*script)|javascript:\S+|;|--|/\*|\*/|\x00|\x1a)",
+    re.IGNORECASE,
+)
+# The rest once an opener has no closing tag after it (none later can have one)
+TOKEN_TAIL_RE = re.compile(r"(?=[j;\-/*\x00\x1a])(?:javascript:\S+|;|--|/\*|\*/|\x00|\x1a)", re.IGNORECASE)
+SCRIPT_OPEN = re.compile(r"<\s*script", re.IGNORECASE)
+SCRIPT_CLOSE = re.compile(r"<\s*/\s*script\s*>", re.IGNORECASE)
+# Streaming: a dangling '<' that may still open a script element
+PARTIAL_OPEN = re.compile(r"<\s*$")
+SCRIPT_WORD = re.compile(r"script", re.IGNORECASE)
+JAVASCRIPT_WORD = re.compile(r"javascript:", re.IGNORECASE)
+
+# Passes of SANITIZE_RE before the rest is finished by _stack_scrub
+SANITIZE_MAX_PASSES = 4
+
+# Largest amount of text held back while waiting for a safe cut point
+STREAM_MAX_BUFFER = 1 << 20
+
+
+class _Elements:
+    """Ends of script elements in s, for openers looked up left to right.
+
+    Matches "[^>]*>.*?<\\s*/\\s*script\\s*>" after an opener: the opening
+    tag ends at the next '>', the element at the first closing tag after
+    it. Both lookups are remembered, so a whole scan stays linear.
+    """
+
+    def __init__(self, s: str):
+        self.s = s
+        self._gt = -1
+        self._starts = None
+        self._ends = None
+
+    def end(self, after: int) -> int:
+        """End of the element whose "<script" ends at after, or -1 if it is unterminated"""
+        if self._gt is None:
+            return -1
+        if self._gt < after:
+            self._gt = self.s.find(">", after)
+            if self._gt < 0:
+                self._gt = None
+                return -1
+        if self._starts is None:
+            closes = [m.span() for m in SCRIPT_CLOSE.finditer(self.s)]
+            self._starts = [start for start, _ in closes]
+            self._ends = [end for _, end in closes]
+        i = bisect_left(self._starts, self._gt + 1)
+        return self._ends[i] if i < len(self._ends) else -1
+
+
+def _last(pattern: re.Pattern, s: str):
+    """Last match of a pattern starting with '<', scanning back from the end"""
+    i = s.rfind("<")
+    while i >= 0:
+        m = pattern.match(s, i)
+        if m:
+            return m
+        i = s.rfind("<", 0, i)
+    return None
+
+
+def _regex_is_linear(s: str) -> bool:
+    """True if SANITIZE_RE scans s in about linear time.
+
+    Only openers after the last '>' that precedes the last closing tag can
+    be unterminated, and each of those makes the lazy element scan run to
+    the end of s. A few of them cost little; many are quadratic.
+    """
+    close = _last(SCRIPT_CLOSE, s)
+    q = s.rfind(">", 0, close.start()) if close else -1
+    budget = 2 * len(s)
+    for _ in SCRIPT_OPEN.finditer(s, q + 1):
+        budget -= len(s) - q
+        if budget < 0:
+            return False
+    return True
+
+
+def _subn(s: str) -> tuple[str, int]:
+    """SANITIZE_RE.subn("", s) in linear time"""
+    if _regex_is_linear(s):
+        return SANITIZE_RE.subn("", s)
+    elements = _Elements(s)
+    out = []
+    pos = n = 0
+    m = TOKEN_RE.search(s)
+    while m:
+        end = m.end()
+        if m.group(1) is not None:
+            end = elements.end(end)
+            if end < 0:
+                # Not an element, and no other rule starts with '<'
+                tail, k = TOKEN_TAIL_RE.subn("", s[m.start():])
+                if not n and not k:
+                    return s, 0
+                out.append(s[pos:m.start()])
+                out.append(tail)
+                return "".join(out), n + k
+        out.append(s[pos:m.start()])
+        pos = end
+        n += 1
+        m = TOKEN_RE.search(s, end)
+    if not n:
+        return s, 0
+    out.append(s[pos:])
+    return "".join(out), n
+
+
+def _stack_scrub(s: str) -> str:
+    """Remove matches of SANITIZE_RE in a single left-to-right pass.
+
+    Kept text never contains a match, so a new one can only end at the
+    character being added: a lone token character, a token pair with the
+    previous character, "javascript:" plus a non-space, or the '>' of a
+    closing tag after a kept opener. Such a match is cut off the end of the
+    kept text instead of being rescanned, which keeps nested input linear.
+    Where removals overlap it may keep a different (still match-free)
+    remainder than repeated SANITIZE_RE passes would.
+    """
+    out = []
+    # ws[i]: start of the whitespace run ending at out[i] (only read for whitespace)
+    ws = []
+    # Index of the '<' of every kept "<\s*script", and the first '>' after
+    # each; openers without a '>' yet are the tail of the list.
+    openers = []
+    gts = []
+    skip = False
+
+    def truncate(n: int):
+        del out[n:], ws[n:]
+        while openers and openers[-1] >= n:
+            openers.pop()
+        while gts and (len(gts) > len(openers) or gts[-1] >= n):
+            gts.pop()
+
+    def before_ws(i: int) -> int:
+        return ws[i] - 1 if i >= 0 and out[i].isspace() else i
+
+    def close_tag_start() -> int:
+        """Start of "<\s*/\s*script\s*" ending out, if '>' would close it, else -1"""
+        i = before_ws(len(out) - 1)
+        if i < 5 or not SCRIPT_WORD.fullmatch("".join(out[i - 5:i + 1])):
+            return -1
+        i = before_ws(i - 6)
+        if i < 0 or out[i] != "/":
+            return -1
+        i = before_ws(i - 1)
+        return i if i >= 0 and out[i] == "<" else -1
+
+    for c in s:
+        space = c.isspace()
+        if skip:
+            # javascript:\S+ takes the whole run
+            if not space:
+                continue
+            skip = False
+        if not space and len(out) >= 11 and out[-1] == ":" and JAVASCRIPT_WORD.fullmatch("".join(out[-11:])):
+            truncate(len(out) - 11)
+            skip = True
+            continue
+        if c in ";\x00\x1a":
+            continue
+        if out and out[-1] + c in ("--", "/*", "*/"):
+            truncate(len(out) - 1)
+            continue
+        if c == ">":
+            start = close_tag_start()
+            if start >= 0 and gts and gts[0] < start:
+                # The leftmost opener's element ends here
+                truncate(openers[0])
+                continue
+            gts.extend([len(out)] * (len(openers) - len(gts)))
+        ws.append(ws[-1] if space and out and out[-1].isspace() else len(out))
+        out.append(c)
+        if c in "tT" and len(out) >= 7 and SCRIPT_WORD.fullmatch("".join(out[-6:])):
+            i = before_ws(len(out) - 7)
+            if i >= 0 and out[i] == "<":
+                openers.append(i)
+    return "".join(out)
+
+
+def _scrub(s: str) -> str:
+    # Removing a match can join its neighbours into a new one ("-<script>..</script>-"),
+    # so passes repeat until nothing matches; clean text costs a single scan.
+    # Nested input needs a pass per level, so past SANITIZE_MAX_PASSES the
+    # rest is left to _stack_scrub.
+    for _ in range(SANITIZE_MAX_PASSES):
+        s, n = _subn(s)
+        if not n:
+            return s
+    return _stack_scrub(s)
 
 
 def sanitize_text(s: str) -> str:
     if not isinstance(s, str):
         return s
-    s = SCRIPT_TAG.sub("", s)
-    s = JS_URL.sub("", s)
-    s = SQL_INJECTION.sub("", s)
-    return s.strip()
+    return _scrub(s).strip()
+
+
+def sanitize_many(texts: Iterable[str]) -> list[str]:
+    """sanitize_text over a batch; non-str items are passed through unchanged"""
+    return [sanitize_text(t) for t in texts]
+
+
+def _closed_end(s: str) -> int:
+    """End of the last complete script element in s, or 0"""
+    elements = _Elements(s)
+    closed = 0
+    m = SCRIPT_OPEN.search(s)
+    while m:
+        end = elements.end(m.end())
+        if end < 0:
+            # Later openers see no closing tag either
+            break
+        closed = end
+        m = SCRIPT_OPEN.search(s, end)
+    return closed
+
+
+def _hold_from(text: str) -> int:
+    """Index in scrubbed text (ending at whitespace) from which output must wait.
+
+    No rule except a script element spans whitespace, so everything is final
+    unless it leaves an unterminated script element or a dangling '<' that
+    could still open one; those back the cut off to the whitespace before
+    them so no other match is split either.
+    """
+    cut = len(text)
+    while cut and not text[cut - 1].isspace():
+        cut -= 1
+    while cut:
+        head = text[:cut]
+        closed = _closed_end(head)
+        hold = SCRIPT_OPEN.search(head, closed) or PARTIAL_OPEN.search(head, closed)
+        if not hold:
+            break
+        cut = hold.start()
+        while cut and not text[cut - 1].isspace():
+            cut -= 1
+    return cut
+
+
+def sanitize_chunks(chunks: Iterable[str], max_buffer: int = STREAM_MAX_BUFFER) -> Iterator[str]:
+    """Sanitize a stream of text chunks without holding the whole input.
+
+    Held-back text is kept in scrubbed form so matches formed by earlier
+    removals still see the text that follows. The output never contains a
+    match. Joined, it equals sanitize_text on the joined input for ordinary
+    text, but the order of removals can differ: a script opener assembled by
+    a removal ("<" + "javascript:x<" + " script>") reaches closing tags that
+    sanitize_text already removed in the same pass, so the stream may drop
+    more. NULs assembling a tag across a cut point, nesting deep enough for
+    _stack_scrub, and a whitespace-free run or script element outgrowing
+    max_buffer can make them differ as well.
+    """
+    buf = ""
+    started = False
+    pending_ws = ""
+
+    def emit(piece: str):
+        nonlocal started, pending_ws
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                return
+            started = True
+        body = piece.rstrip()
+        if body:
+            out = pending_ws + body
+            pending_ws = piece[len(body):]
+            yield out
+        else:
+            pending_ws += piece
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        # Only text up to the newest whitespace can be final; a run without
+        # whitespace waits for the next chunk (bounded by max_buffer).
+        i = len(chunk)
+        while i and not chunk[i - 1].isspace():
+            i -= 1
+        if not i:
+            if len(buf) > max_buffer:
+                yield from emit(_scrub(buf))
+                buf = ""
+            continue
+        # Hold back unterminated script elements before scrubbing (other rules
+        # would otherwise eat into them), then again for any that removals created
+        split = _hold_from(buf[:len(buf) - len(chunk) + i])
+        text = _scrub(buf[:split])
+        cut = _hold_from(text)
+        if not cut and len(buf) > max_buffer:
+            cut = len(text)
+        buf = text[cut:] + buf[split:]
+        if cut:
+            yield from emit(text[:cut])
+    if buf:
+        yield from emit(_scrub(buf))
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: python -m shared.sanitize [size_kb] [repeats]
+    import sys
+    import timeit
+
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    clean = ("The new onboarding process was confusing and my manager never followed up. " * 200)
+    dirty = ("Please fix it; see <script>alert(1)</script> or javascript:void(0) -- /* x */ now. " * 200)
+    unclosed = "<script>x " * 1000
+    samples = {
+        "clean": clean[: size_kb * 1024],
+        "dirty": dirty[: size_kb * 1024],
+        # Openers without a closing tag: linear, not quadratic, in the input size
+        "open": unclosed[: size_kb * 1024],
+        # Nested elements: one pass per level until _stack_scrub takes over
+        "nested": ("<scr" * 1000 + "ipt></script>" * 1000)[: size_kb * 1024],
+    }
+    print(f"sanitize_text, {size_kb} KB input, {repeats} runs")
+    for name, text in samples.items():
+        secs = min(timeit.repeat(lambda: sanitize_text(text), number=repeats, repeat=3))
+        per_kb = secs / repeats / (len(text) / 1024) * 1e6
+        print(f"  {name:6s} {per_kb:8.2f} us/KB  ({secs / repeats * 1e6:.1f} us/call)")
+    batch = [samples["clean"]] * 64
+    secs = min(timeit.repeat(lambda: sanitize_many(batch), number=max(1, repeats // 64), repeat=3))
+    print(f"  batch  {secs / max(1, repeats // 64) / 64 * 1e6:8.1f} us/text (64 texts)")
+    big = samples["dirty"] * 64
+    chunks = [big[i:i + 4096] for i in range(0, len(big), 4096)]
+    secs = min(timeit.repeat(lambda: "".join(sanitize_chunks(chunks)), number=10, repeat=3))
+    print(f"  stream {secs / 10 / (len(big) / 1024) * 1e6:8.2f} us/KB  ({len(big) // 1024} KB in 4 KB chunks)")
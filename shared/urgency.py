@@ -0,0 +1,53 @@
+import os
+
+from shared.keywords import KeywordConfig
+
+# The keyword heuristic lives here so the urgency agent and the orchestrator
+# (which uses it to pick a job queue lane) score texts the same way.
+
+# Default keyword lists; URGENCY_KEYWORDS_FILE (JSON, {"high": {...}, "medium": {...}}
+# with term lists or term -> weight maps) overrides them and is hot-reloaded.
+DEFAULT_URGENCY_KEYWORDS = {
+    # High urgency keywords
+    'high': [
+        'urgent', 'emergency', 'critical', 'immediate', 'asap', 'crisis', 'serious',
+        'harassment', 'discrimination', 'bullying', 'threat', 'danger', 'unsafe',
+        'quit', 'leaving', 'resign', 'fire', 'terminate', 'sue', 'legal', 'lawyer',
+        'mental health', 'depression', 'anxiety', 'suicide', 'self-harm'
+    ],
+    # Medium urgency keywords
+    'medium': [
+        'concern', 'worried', 'problem', 'issue', 'complaint', 'unhappy', 'frustrated',
+        'stress', 'overwhelmed', 'burnout', 'exhausted', 'tired', 'sick', 'illness',
+        'conflict', 'disagreement', 'argument', 'fight', 'tension', 'hostile'
+    ],
+}
+urgency_keywords = KeywordConfig(
+    os.getenv('URGENCY_KEYWORDS_FILE'),
+    DEFAULT_URGENCY_KEYWORDS,
+    check_interval=float(os.getenv('URGENCY_KEYWORDS_RELOAD_SECONDS', '5'))
+)
+
+
+def heuristic_urgency(txt: str) -> dict:
+    """Fallback urgency detection using keyword matching"""
+    hits = urgency_keywords.matcher.scan(txt or '')
+    high = hits.get('high')
+    medium = hits.get('medium')
+
+    if high:
+        return {
+            'urgency': 'High',
+            'confidence': min(0.9, 0.6 + (high['score'] * 0.1)),
+            'reason': f"Contains {len(high['terms'])} high-urgency keywords",
+            'matched': high['terms'] + (medium['terms'] if medium else [])
+        }
+    elif medium:
+        return {
+            'urgency': 'Medium',
+            'confidence': min(0.8, 0.5 + (medium['score'] * 0.1)),
+            'reason': f"Contains {len(medium['terms'])} medium-urgency keywords",
+            'matched': medium['terms']
+        }
+    else:
+        return {'urgency': 'Low', 'confidence': 0.7, 'reason': 'No urgency indicators detected', 'matched': []}